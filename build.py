@@ -1,20 +1,34 @@
+import os
 import sys
+import queue
+import atexit
 import json
 import shutil
+import hmac
 import hashlib
+import tarfile
+import zipfile
 import logging
 import argparse
+import concurrent.futures
 import platform as _platform
 import subprocess
 import logging.config
+import logging.handlers
 from pathlib import Path
 
 import requests
+try:
+    # isal's igzip is a drop-in, SIMD accelerated replacement for gzip
+    from isal import igzip as gzip
+except ImportError:
+    import gzip
 
 ERRORS = {
     'UNSUPPORTED_PLATFORM': 1,
     'AMBIGUOUS_INSTALL': 2,
     'HASH_MISMATCH': 3,
+    'ASSET_NOT_FOUND': 4,
 }
 
 HERE = Path(__file__).parent
@@ -28,9 +42,17 @@ cli.add_argument(
 )
 cli.add_argument(
     "--hash-buff-size",
-    help="The buffer size for reads when calculating hashes",
+    help="The buffer size for reads when calculating hashes "
+         "(only used when hashlib.file_digest is unavailable)",
     default=65536,
 )
+cli.add_argument(
+    "--download-parts",
+    help="The number of concurrent byte-range requests used to download "
+         "the Python release (1 disables ranged downloads)",
+    default=4,
+    type=int,
+)
 cli.add_argument(
     "--build-directory",
     help="The directory to use for downloads and other file "
@@ -43,6 +65,13 @@ cli.add_argument(
          "WARNING: This directory will be deleted",
     default=HERE.joinpath("dist"),
 )
+cli.add_argument(
+    "--github-cache",
+    help="A file used to cache Github release metadata between builds, "
+         "requests are revalidated with their ETag",
+    default=HERE.joinpath(".gh_cache.json"),
+    type=Path,
+)
 cli.add_argument(
     "--log-level",
     help="The level (0-50) at which to filter log levels (lower is more verbose)",
@@ -53,6 +82,8 @@ args = cli.parse_args()
 
 TARGET_PYTHON_VERSION = args.python_version
 HASH_BUFF_SIZE = args.hash_buff_size
+DOWNLOAD_PARTS = args.download_parts
+GITHUB_CACHE = args.github_cache
 
 BUILD_DIRECTORY = args.build_directory
 shutil.rmtree(BUILD_DIRECTORY, ignore_errors=True)
@@ -87,7 +118,8 @@ logging.config.dictConfig(
                 "formatter": "simple",
                 "level": args.log_level,
                 "filename": HERE.joinpath('build.log'),
-                "mode": "w"
+                "mode": "w",
+                "delay": True
             }
         },
         "root": {
@@ -99,8 +131,41 @@ logging.config.dictConfig(
         }
     }
 )
+# Hand the configured handlers to a background QueueListener so that
+# logging calls only enqueue the record and never block on I/O
+_root_logger = logging.getLogger()
+_log_queue = queue.Queue(-1)
+_log_listener = logging.handlers.QueueListener(
+    _log_queue,
+    *_root_logger.handlers,
+    respect_handler_level=True,
+)
+_root_logger.handlers = [logging.handlers.QueueHandler(_log_queue)]
+_log_listener.start()
+atexit.register(_log_listener.stop)
 log = logging.getLogger(__name__)
 
+# All Github requests share one session so TLS connections are kept
+# alive and reused between requests to the same host
+SESSION = requests.Session()
+SESSION.headers.update(
+    {
+        'X-GitHub-Api-Version': '2022-11-28',
+        'Accept': 'application/vnd.github+json',
+        'User-Agent': 'mast-build',
+    }
+)
+_adapter = requests.adapters.HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=max(4, DOWNLOAD_PARTS),
+)
+for _prefix in (
+    'https://api.github.com',
+    'https://raw.githubusercontent.com',
+    'https://objects.githubusercontent.com',
+):
+    SESSION.mount(_prefix, _adapter)
+
 def fail_for_unsupported_platform(platform):
     log.critical(f"Unable to continue due to unsupported platform: {platform}")
     sys.exit(ERRORS['UNSUPPORTED_PLATFORM'])
@@ -113,8 +178,21 @@ def fail_for_hash_mismatch(expected, actual):
     log.critical(f"Unable to continue. Release file does not match hash. Expected: '{expected}', Actual: '{actual}'")
     sys.exit(ERRORS['HASH_MISMATCH'])
 
+def fail_for_missing_asset(description, release_names):
+    log.critical(f"Unable to continue. Release asset not found: {description}, out of: {', '.join(release_names) or 'no matching assets'}")
+    sys.exit(ERRORS['ASSET_NOT_FOUND'])
+
+def new_sha256():
+    # hashlib is backed by OpenSSL when available, which already uses the
+    # SHA-NI / AVX2 code paths on CPUs that support them, so there is no
+    # need for a separate accelerated backend
+    return hashlib.sha256()
+
 def get_file_sha256(p):
-    sha256 = hashlib.sha256()
+    if hasattr(hashlib, 'file_digest'):
+        with p.open('rb') as fp:
+            return hashlib.file_digest(fp, new_sha256).digest()
+    sha256 = new_sha256()
     with p.open('rb') as fp:
         while True:
             data = fp.read(HASH_BUFF_SIZE)
@@ -122,7 +200,128 @@ def get_file_sha256(p):
                 break
             else:
                 sha256.update(data)
-    return sha256.hexdigest()
+    return sha256.digest()
+
+# GET url and return the decoded JSON body. The body and ETag of each
+# response are kept in GITHUB_CACHE (which lives outside of the build
+# directory so it survives between builds) and sent back as
+# If-None-Match, so unchanged metadata comes back as an empty 304.
+def get_json_cached(url):
+    try:
+        cache = json.loads(GITHUB_CACHE.read_text())
+    except (OSError, ValueError):
+        cache = {}
+    headers = {}
+    if url in cache:
+        headers['If-None-Match'] = cache[url]['etag']
+    response = SESSION.get(url, headers=headers)
+    if response.status_code == 304:
+        log.debug(f"Using cached response for {url}")
+        return json.loads(cache[url]['body'])
+    etag = response.headers.get('ETag')
+    if response.ok and etag:
+        cache[url] = {'etag': etag, 'body': response.text}
+        GITHUB_CACHE.write_text(json.dumps(cache))
+    return response.json()
+
+# Stream a Github release asset to p, hashing the bytes as they arrive
+# so the file never needs to be read back. Returns the raw digest.
+def download_asset(url, p):
+    response = SESSION.get(
+        url,
+        headers={'Accept': 'application/octet-stream'},
+        stream=True,
+    )
+    response.raise_for_status()
+    sha256 = new_sha256()
+    with p.open('wb') as fp:
+        for chunk in response.iter_content(1 << 20):
+            fp.write(chunk)
+            sha256.update(chunk)
+    return sha256.digest()
+
+# Download a Github release asset to p as DOWNLOAD_PARTS concurrent
+# byte-ranges, each written into its own slice of a pre-sized file.
+# Falls back to download_asset when the server does not advertise
+# range support, or when any range comes back as anything but a partial
+# response. Returns the raw digest.
+def download_asset_ranges(url, p):
+    response = SESSION.head(
+        url,
+        headers={'Accept': 'application/octet-stream'},
+        allow_redirects=True,
+    )
+    size = int(response.headers.get('Content-Length', 0))
+    if DOWNLOAD_PARTS < 2 or not size or response.headers.get('Accept-Ranges') != 'bytes':
+        return download_asset(url, p)
+    # Request the ranges from the final location so each one does not
+    # have to follow the redirect again
+    range_url = response.url
+    with p.open('wb') as fp:
+        fp.truncate(size)
+    part_size = -(-size // DOWNLOAD_PARTS)
+
+    def download_range(start):
+        end = min(start + part_size, size) - 1
+        response = SESSION.get(
+            range_url,
+            headers={'Range': f'bytes={start}-{end}'},
+            stream=True,
+        )
+        response.raise_for_status()
+        if response.status_code != 206:
+            # The Range header was ignored and this is the whole file
+            response.close()
+            return False
+        with p.open('r+b') as fp:
+            fp.seek(start)
+            for chunk in response.iter_content(1 << 20):
+                fp.write(chunk)
+        return True
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=DOWNLOAD_PARTS) as executor:
+        ranged = list(executor.map(download_range, range(0, size, part_size)))
+    if not all(ranged):
+        log.warning(f"Server did not honour the Range header, downloading {p.name} in one piece")
+        return download_asset(url, p)
+    return get_file_sha256(p)
+
+# Extract the release archive into directory, placing the contents of
+# its top-level python directory under python/{TARGET_PYTHON_VERSION}.
+# Gzipped tarballs are read as a stream in a single pass and members are
+# renamed as they are extracted, anything else goes through
+# shutil.unpack_archive and is moved into place afterwards
+def extract_release(p, directory):
+    if not p.name.endswith(('.tar.gz', '.tgz')):
+        shutil.unpack_archive(p, directory)
+        src_dir = directory.joinpath('python')
+        dst_dir = src_dir.joinpath(TARGET_PYTHON_VERSION)
+        dst_dir.mkdir()
+        for item in src_dir.iterdir():
+            if item != dst_dir:
+                shutil.move(item, dst_dir.joinpath(item.name))
+        return
+
+    def relocate(name):
+        if name == 'python' or name.startswith('python/'):
+            return name.replace('python', f'python/{TARGET_PYTHON_VERSION}', 1)
+        return name
+
+    kwargs = {'filter': 'tar'} if hasattr(tarfile, 'tar_filter') else {}
+    with gzip.open(p, 'rb') as gz, tarfile.open(fileobj=gz, mode='r|') as tf:
+        for member in tf:
+            member.name = relocate(member.name)
+            if member.islnk():
+                member.linkname = relocate(member.linkname)
+            tf.extract(member, directory, **kwargs)
+
+# copy_function for shutil.copytree which hardlinks files when source
+# and destination share a filesystem and falls back to a real copy
+def link_or_copy(src, dst):
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
 
 platform = sys.platform
 if platform.startswith('linux'):
@@ -154,153 +353,147 @@ log.debug(f"Found requirements_file: {requirements_file}")
 
 # Download a prebuilt Python distribution
 # First, get the latest release tag
-response = requests.get(
+response_json = get_json_cached(
     'https://raw.githubusercontent.com/indygreg/python-build-standalone/latest-release/latest-release.json',
 )
-response_json = response.json()
 log.debug(f"Found response json: {response_json}")
 tag = response_json['tag']
 log.debug(f"Found tag: {tag}")
 
 # Second, Get the release ID from Github API
-response = requests.get(
+response_json = get_json_cached(
     f'https://api.github.com/repos/indygreg/python-build-standalone/releases/tags/{tag}',
-    headers={
-        'X-GitHub-Api-Version': '2022-11-28',
-        'Accept': 'application/vnd.github+json'
-    }
 )
-response_json = response.json()
 log.debug(f"Found response json: {response_json}")
 assets = response_json['assets']
 log.debug(f"Found assets: {assets}")
 release_names = [d['name'] for d in assets]
 log.debug(f"Found release_names: {release_names}")
-# Filter to install_only build configuration
-release_names = [name for name in release_names if 'install_only_stripped' in name]
-log.debug(f"Found 'install_only_stripped' release_names: {release_names}")
-# Filter to only the python version that we are interested in
-release_names = [name for name in release_names if TARGET_PYTHON_VERSION in name]
-log.debug(f"Found correct python version release_names: {release_names}")
-# Filter to only platform and architecture that we are interested in
+# Filter to the install_only build configuration of the python version,
+# platform and bitness that we are interested in, in a single pass
+includes = ['install_only_stripped', TARGET_PYTHON_VERSION]
+excludes = []
 if platform == 'windows':
-    release_names = [name for name in release_names if 'windows-msvc-shared' in name]
+    includes.append('windows-msvc-shared')
+    includes.append('x86_64' if sys.maxsize > 2**32 else 'i686')
 elif platform == 'linux':
-    release_names = [name for name in release_names if 'unknown-linux-gnu' in name]
-elif platform == 'darwin':
-    release_names = [name for name in release_names if 'apple-darwin' in name]
-
-log.debug(f"Found platform specific release_names: {release_names}")
-
-# Filter to only bitness that we are interested in
-if platform == "windows":
+    includes.append('unknown-linux-gnu')
     if sys.maxsize > 2**32:
-        release_names = [name for name in release_names if 'x86_64' in name]
+        includes.append('x86_64')
+        excludes.extend(['x86_64_v2', 'x86_64_v3', 'x86_64_v4'])
     else:
-        release_names = [name for name in release_names if 'i686' in name]
-elif platform == "linux":
-    if sys.maxsize > 2**32:
-        release_names = [name for name in release_names if 'x86_64' in name]
-        release_names = [name for name in release_names if 'x86_64_v2' not in name]
-        release_names = [name for name in release_names if 'x86_64_v3' not in name]
-        release_names = [name for name in release_names if 'x86_64_v4' not in name]
-    else:
-        release_names = [name for name in release_names if 'i686' in name]
-elif platform == "darwin":
+        includes.append('i686')
+elif platform == 'darwin':
+    includes.append('apple-darwin')
     if _platform.machine() == "x86_64":
-        release_names = [name for name in release_names if 'x86_64' in name]
+        includes.append('x86_64')
     elif _platform.machine() == "arm64":
-        release_names = [name for name in release_names if 'aarch64' in name]
-log.debug(f"Found bitness-correct release_names: {release_names}")
+        includes.append('aarch64')
+log.debug(f"Filtering release_names by includes: {includes} and excludes: {excludes}")
+release_names = [
+    name for name in release_names
+    if all(i in name for i in includes) and not any(e in name for e in excludes)
+]
+log.debug(f"Found matching release_names: {release_names}")
 
 # There should be two: one for the hash and one for the actual release
 if len(release_names) > 2:
     fail_for_ambiguity(release_names)
 
 # Third, find the release file and the hash file
-for name in release_names:
-    if name.endswith('sha256'):
-        hash_file = name
-    else:
-        release_file = name
+hash_file = next((name for name in release_names if name.endswith('sha256')), None)
+if hash_file is None:
+    fail_for_missing_asset('hash file', release_names)
+release_file = next((name for name in release_names if not name.endswith('sha256')), None)
+if release_file is None:
+    fail_for_missing_asset('release file', release_names)
 
 log.debug(f'Found hash_file: {hash_file}')
 log.debug(f'Found release_file: {release_file}')
 
 # Pull out the url for the assets we identified
-for asset in assets:
-    if asset['name'] == hash_file:
-        # get url for hash_file
-        hash_file_url = asset['url']
-    elif asset['name'] == release_file:
-        # get url for release_file
-        release_file_url = asset['url']
+url_by_name = {asset['name']: asset['url'] for asset in assets}
+hash_file_url = url_by_name[hash_file]
+release_file_url = url_by_name[release_file]
 
 log.debug(f'Found hash_file_url: {hash_file_url}')
 log.debug(f'Found release_file_url: {release_file_url}')
 
-# Fourth Download Hash file
-hash_file_response = requests.get(
-    hash_file_url,
-    headers={
-        'X-GitHub-Api-Version': '2022-11-28',
-        'Accept': 'application/octet-stream'
-    }
-)
+# Fourth and Fifth, download the hash file and the release file
+# concurrently, the hash file is small enough that it finishes while
+# the release file is still downloading
 hash_file_path = BUILD_DIRECTORY.joinpath(hash_file)
-with hash_file_path.open('wb') as fp:
-    fp.write(hash_file_response.content)
+release_file_path = BUILD_DIRECTORY.joinpath(release_file)
+with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+    hash_file_future = executor.submit(download_asset, hash_file_url, hash_file_path)
+    release_file_future = executor.submit(download_asset_ranges, release_file_url, release_file_path)
+    hash_file_future.result()
+    release_file_sha256 = release_file_future.result()
 hash_hex = hash_file_path.read_text().strip()
 log.debug(hash_hex)
 
-# Fifth Download Release file
-release_file_response = requests.get(
-    release_file_url,
-    headers={
-        'X-GitHub-Api-Version': '2022-11-28',
-        'Accept': 'application/octet-stream'
-    }
-)
-release_file_path = BUILD_DIRECTORY.joinpath(release_file)
-with release_file_path.open('wb') as fp:
-    fp.write(release_file_response.content)
-
 # Verify the hash of the downloaded release file
-release_file_sha256 = get_file_sha256(release_file_path)
-if hash_hex != release_file_sha256:
-    fail_for_hash_mismatch(hash_hex, release_file_sha256)
+# Compare the raw digests in constant time rather than the hex strings,
+# a hash file which is not valid hex cannot match
+try:
+    expected_sha256 = bytes.fromhex(hash_hex)
+except ValueError:
+    expected_sha256 = None
+if expected_sha256 is None or not hmac.compare_digest(expected_sha256, release_file_sha256):
+    fail_for_hash_mismatch(hash_hex, release_file_sha256.hex())
 else:
     log.info("Downloaded Python release matches expected hash value")
 
 # Extract the release file into the dist directory
-shutil.unpack_archive(
-    release_file_path,
-    ASSEMBLE_DIRECTORY,
-)
-
-# Move everything under python directory into subdirectory based on python version
-src_dir = ASSEMBLE_DIRECTORY.joinpath('python')
-dst_dir = src_dir.joinpath(TARGET_PYTHON_VERSION)
-for item in src_dir.iterdir():
-    if item != dst_dir:
-        shutil.move(item, dst_dir.joinpath(item.name))
+extract_release(release_file_path, ASSEMBLE_DIRECTORY)
 
 if platform == "windows":
     python_executable = ASSEMBLE_DIRECTORY.joinpath('python').joinpath(TARGET_PYTHON_VERSION).joinpath('python')
 else:
     python_executable = ASSEMBLE_DIRECTORY.joinpath('python').joinpath(TARGET_PYTHON_VERSION).joinpath('bin').joinpath('python3')
 
-# Upgrade pip
-command = f'{python_executable} -m pip install --upgrade pip'
-subprocess.run(command, shell=True)
-
-# Install dependencies
-command = f'{python_executable} -m pip install --no-warn-script-location -r {requirements_file}'
-subprocess.run(command, shell=True)
+# Upgrade pip, install dependencies and install the mast package in one
+# pip invocation so the interpreter and pip only start up once. Wheels
+# are cached outside of the build directory so later builds do not have
+# to download them again, and byte-compiling is deferred to a single
+# parallel compileall run below
+pip_env = {
+    **os.environ,
+    'PIP_CACHE_DIR': str(HERE.joinpath('.pip-cache')),
+    'PIP_DISABLE_PIP_VERSION_CHECK': '1',
+    'PYTHONDONTWRITEBYTECODE': '1',
+}
+subprocess.run(
+    [
+        str(python_executable),
+        '-m',
+        'pip',
+        'install',
+        '--no-warn-script-location',
+        '--prefer-binary',
+        '--no-compile',
+        '--upgrade',
+        'pip',
+        '-r',
+        str(requirements_file),
+        str(HERE),
+    ],
+    check=True,
+    env=pip_env,
+)
 
-# Install mast package
-command = f'{python_executable} -m pip install {HERE}'
-subprocess.run(command, shell=True)
+# Byte-compile everything installed above using all available cores
+subprocess.run(
+    [
+        str(python_executable),
+        '-m',
+        'compileall',
+        '-q',
+        '-j0',
+        str(ASSEMBLE_DIRECTORY.joinpath('python').joinpath(TARGET_PYTHON_VERSION)),
+    ],
+    check=True,
+)
 
 # Copy all files from files/mast_home
 files_directory = HERE.joinpath('files')
@@ -309,7 +502,9 @@ for item in mast_home_directory.iterdir():
     if item.is_dir():
         shutil.copytree(
             item,
-            ASSEMBLE_DIRECTORY.joinpath(item.name)
+            ASSEMBLE_DIRECTORY.joinpath(item.name),
+            copy_function=link_or_copy,
+            dirs_exist_ok=True,
         )
     else:
         log.critical("Non-directory item in files/mast_home")
@@ -328,15 +523,23 @@ for item in script_dir.iterdir():
         shutil.copy(item, file_path)
     if platform.lower() != "windows":
         file_path.chmod(0o750)
-command = f'{python_executable} -c "import mast; print(mast.__version__)"'
-output = subprocess.check_output(command, shell=True)
+output = subprocess.check_output(
+    [str(python_executable), '-c', 'import mast; print(mast.__version__)'],
+)
 mast_version = output.strip().decode()
 
-shutil.make_archive(
-    DIST_DIRECTORY.joinpath(
-        f'MAST-{mast_version}_py{TARGET_PYTHON_VERSION}_{platform}',
-    ),
-    format='zip',
-    root_dir=ASSEMBLE_DIRECTORY,
-    base_dir='.',
+# Level 1 DEFLATE is several times faster than the default level and the
+# archive is only marginally larger, since much of it (shared libraries,
+# already compressed wheels) does not compress well anyway
+archive_path = DIST_DIRECTORY.joinpath(
+    f'MAST-{mast_version}_py{TARGET_PYTHON_VERSION}_{platform}.zip',
 )
+with zipfile.ZipFile(
+    archive_path,
+    'w',
+    compression=zipfile.ZIP_DEFLATED,
+    compresslevel=1,
+    allowZip64=True,
+) as zf:
+    for item in sorted(ASSEMBLE_DIRECTORY.rglob('*')):
+        zf.write(item, item.relative_to(ASSEMBLE_DIRECTORY))
@@ -2,7 +2,19 @@ from mast.datapower import datapower
 from mast.logging import make_logger
 from mast.cli import Cli
 from lxml import etree
-from fnmatch import fnmatch
+from fnmatch import fnmatch, translate
+import os
+import re
+
+# Compiled once, the external filter is evaluated by libxml2 rather than
+# in a Python list comprehension
+CONFIG_OBJECTS = etree.XPath(
+    "env:Body/dp:response/dp:config/*[not(@external='true')]",
+    namespaces={
+        "env": "http://schemas.xmlsoap.org/soap/envelope/",
+        "dp": datapower.MGMT_NAMESPACE,
+    },
+)
 
 def main(
     appliances=[],
@@ -17,6 +29,13 @@ def main(
     check_hostname = not no_check_hostname
     if exclude is None:
         exclude = []
+    # Combine the exclude patterns into a single compiled regex so each
+    # object name is matched once instead of once per pattern
+    exclude_re = None
+    if exclude:
+        exclude_re = re.compile(
+            "|".join(translate(os.path.normcase(pattern)) for pattern in exclude)
+        )
     env = datapower.Environment(
         appliances,
         credentials,
@@ -36,22 +55,20 @@ def main(
                 domain=domain,
                 persisted=False,
             )
-            objs = config.xml.findall(datapower.CONFIG_XPATH)
-            objs  =  [obj for obj in objs if obj.get("external") != "true"]
+            objs = CONFIG_OBJECTS(config.xml)
+            # All of the CryptoProfiles in this domain are modified with a
+            # single modify-config request
+            appliance.request.clear()
+            request = appliance.request.request
+            request.set("domain", domain)
+            modify_config = etree.SubElement(request , f"{{{datapower.MGMT_NAMESPACE}}}modify-config")
             for obj in objs:
                 name = obj.get("name")
-                skip = False
-                for pattern in exclude:
-                    if fnmatch(name, pattern):
-                        print(f"\t\t\tCryptoProfile '{name}' matched exclude pattern '{pattern}', skipping...")
-                        skip = True
-                if skip:
+                if exclude_re and exclude_re.match(os.path.normcase(name)):
+                    pattern = next(pattern for pattern in exclude if fnmatch(name, pattern))
+                    print(f"\t\t\tCryptoProfile '{name}' matched exclude pattern '{pattern}', skipping...")
                     continue
                 print(f"\t\t\t{name}")
-                appliance.request.clear()
-                request = appliance.request.request
-                request.set("domain", domain)
-                modify_config = etree.SubElement(request , f"{{{datapower.MGMT_NAMESPACE}}}modify-config")
                 class_node = etree.SubElement(modify_config, "CryptoProfile")
                 class_node.set("name", name)
                 ssl_options = etree.SubElement(class_node, "SSLOptions")
@@ -64,6 +81,7 @@ def main(
                 disable_tls_v_1_d_2 = etree.SubElement(ssl_options, "Disable-TLSv1d2")
                 disable_tls_v_1_d_2.text = "off"
 
+            if len(modify_config):
                 if dry_run:
                     print(appliance.request)
                 else:
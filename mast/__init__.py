@@ -13,5 +13,7 @@
 # along with MAST.  If not, see <https://www.gnu.org/licenses/>.
 #
 # Copyright 2015-2024, McIndi Solutions, All rights reserved.
-import pkg_resources  # part of setuptools
-__version__ = pkg_resources.require("mast")[0].version
+# importlib.metadata looks up the single distribution rather than
+# building pkg_resources' WorkingSet of every installed distribution
+from importlib.metadata import version as _version
+__version__ = _version("mast")
@@ -23,10 +23,10 @@ appliances.
 from mast.cli import Cli
 from mast.plugins.web import Plugin
 from mast.datapower import datapower
-from pkg_resources import resource_string
+from importlib.resources import files
 from mast.logging import make_logger, logged
 import mast.plugin_utils.plugin_utils as util
-from functools import partial, update_wrapper
+from functools import partial, update_wrapper, lru_cache
 import mast.plugin_utils.plugin_functions as pf
 from mast.pprint import pprint_xml
 
@@ -1126,8 +1126,9 @@ DO NOT USE.__"""
 # ~#~#~#~#~#~#~#
 
 
+@lru_cache(maxsize=None)
 def get_data_file(f):
-    return resource_string(__name__, 'docroot/{}'.format(f)).decode()
+    return files(__package__).joinpath('docroot', f).read_text()
 
 
 class WebPlugin(Plugin):
@@ -13,32 +13,56 @@
 # along with MAST.  If not, see <https://www.gnu.org/licenses/>.
 #
 # Copyright 2015-2024, McIndi Solutions, All rights reserved.
+import io
 import os
 import re
 import csv
 import sys
+import json
 import flask
 import OpenSSL
 import openpyxl
 from .utils import *
 from time import sleep
 from mast.cli import Cli
-from datetime import datetime
+from datetime import datetime, timedelta
 from mast.pprint import print_table, html_table
 from mast.plugins.web import Plugin
 from mast.logging import make_logger
+from mast.config import MAST_HOME
 from mast.timestamp import Timestamp
 import xml.etree.cElementTree as etree
-from pkg_resources import resource_string
+from lxml.etree import XPath
+from importlib.resources import files
 import mast.datapower.datapower as datapower
 import mast.plugin_utils.plugin_utils as util
-from functools import partial, update_wrapper
+from functools import partial, update_wrapper, lru_cache
+from concurrent.futures import ThreadPoolExecutor
 from dateutil import parser, tz, relativedelta
 import mast.plugin_utils.plugin_functions as pf
 from mast import __version__
 
 cli = Cli()
 
+# The maximum number of appliances to work on concurrently
+MAX_WORKERS = 16
+
+# Certificate details from previous cert-audits, keyed by
+# "hostname|domain|certificate-object"
+CERT_AUDIT_CACHE_FILE = os.path.join(MAST_HOME, "var", "cache", "cert-audit.json")
+
+# The separator between a DataPower location and a path, ie. "cert:///"
+COLON_SLASHES = re.compile(r":[/]*")
+
+LOCAL_TZ = tz.tzlocal()
+UTC_TZ = tz.tzutc()
+
+# Compiled once so each certificate only needs a single search of the
+# whole response, the fields are then read from the CertificateDetails
+# node with ElementPath
+CERTIFICATE_DETAILS = XPath("//*[local-name()='CertificateDetails']")
+SUBJECT_ALT_NAMES = "{*}Extensions/{*}Extension[@name='subjectAltName']/{*}item"
+
 
 @cli.command("cert-audit", category="certificates")
 def cert_audit(appliances=[],
@@ -51,6 +75,7 @@ def cert_audit(appliances=[],
                date_time_format="%A, %B %d, %Y, %X",
                localtime=False,
                days_only=False,
+               no_cache=False,
                web=False):
     """Perform an audit of all CryptoCertificate objects which are
 up and enabled for the specified appliances and domains.
@@ -98,6 +123,10 @@ for information on using this parameter
 local time instead of UTC.
 * `--days-only`: If specified, only the number of days (floored) will be
 reported in the `time-since-expiration` and `time-until-expiration` columns.
+* `--no-cache`: If specified, the details of every certificate will be
+retrieved from the appliances. Otherwise the details retrieved by previous
+audits (cached in `$MAST_HOME/var/cache/cert-audit.json`) are reused for
+certificates whose file has not been modified since.
 * `-w, --web`: __For Internel Use Only, will be removed in future versions.
 DO NOT USE.__"""
     logger = make_logger("cert-audit")
@@ -111,8 +140,7 @@ DO NOT USE.__"""
     if extension not in [".csv", ".xlsx"]:
         raise ValueError("out_file must be either csv or xlsx")
 
-    if not os.path.exists(os.path.dirname(out_file)):
-        os.makedirs(os.path.dirname(out_file))
+    os.makedirs(os.path.dirname(out_file), exist_ok=True)
     check_hostname = not no_check_hostname
     env = datapower.Environment(
         appliances,
@@ -120,7 +148,7 @@ DO NOT USE.__"""
         timeout,
         check_hostname=check_hostname)
 
-    header_row = [
+    header_row = (
         "appliance",
         "domain",
         "certificate-object",
@@ -136,139 +164,59 @@ DO NOT USE.__"""
         "is-expired",
         "time-since-expiration",
         "time-until-expiration",
-    ]
-    rows = [header_row]
-    for appliance in env.appliances:
-        logger.info("Checking appliance {}".format(appliance.hostname))
-        if not web:
-            print(appliance.hostname)
-        _domains = domains
-        if "all-domains" in domains:
-            _domains = appliance.domains
-        for domain in _domains:
-            logger.info("In domain {}".format(domain))
-            if not web:
-                print("\t", domain)
-            config = appliance.get_config("CryptoCertificate", domain=domain, persisted=False)
-            certs = [x for x in config.xml.findall(datapower.CONFIG_XPATH)]
-
-            # Filter out disabled objects because the results won't change,
-            # but we will perform less network traffic
-            certs = [x for x in certs if x.find("mAdminState").text == "enabled"]
-
-            for cert in certs:
-                logger.info("Exporting cert {}".format(cert))
-                try:
-                    filename = cert.find("Filename").text
-                except:
-                    rows.append([appliance.hostname, domain, name])
-                    print(f"Skipping cert: {cert}")
-                    logger.exception(f"An exception has occurred. The certificate {cert.get('name')} is being skipped and the error is being ignored")
-                    continue
-                name = cert.get("name")
-                # _filename = name
-                password_alias = cert.find("Alias")
-                if password_alias is not None:
-                    password_alias = password_alias.text
-                if not web:
-                    print("\t\t", name)
-                row = [appliance.hostname, domain, name, password_alias, filename]
-
-                try:
-                    details = appliance.get_certificate_details(
-                            domain=domain,
-                            certificate_name=name,
-                        )
-                except Exception as exception:
-                    logger.exception(f"An exception has occurred. The certificate {name} is being skipped and the error is being ignored")
-                    if not web:
-                        print(f"Skipping Cert: {name}, exception: {exception}")
-                    rows.append(row)
-                    continue
-                try:
-                    subject = details.xml.xpath(r"//*[local-name()='CertificateDetails']/*[local-name()='Subject']/text()")[0]
-                    issuer = details.xml.xpath(r"//*[local-name()='CertificateDetails']/*[local-name()='Issuer']/text()")[0]
-                    serial_number = details.xml.xpath(r"//*[local-name()='CertificateDetails']/*[local-name()='SerialNumber']/text()")[0]
-                    signature_algorithm = details.xml.xpath(r"//*[local-name()='CertificateDetails']/*[local-name()='SignatureAlgorithm']/text()")[0]
-                    notBefore = details.xml.xpath(r"//*[local-name()='CertificateDetails']/*[local-name()='NotBefore']/text()")[0]
-                    notAfter = details.xml.xpath(r"//*[local-name()='CertificateDetails']/*[local-name()='NotAfter']/text()")[0]
-                except:
-                    logger.exception(f"Could not parse details for cert {name}, received response {details}, skipping.")
-                    if not web:
-                        print(f"Skipping Cert: {name}, details: {details}")
-                    rows.append(row)
-                    continue
-                try:
-                    sans = ',\r\n'.join(details.xml.xpath(r"//*[local-name()='CertificateDetails']/*[local-name()='Extensions']/*[local-name()='Extension' and @name='subjectAltName']/*[local-name()='item']/text()"))
-                except:
-                    logger.exception(f"Could not parse SANs for cert {name}, received response {details}, skipping.")
-                    if not web:
-                        print(f"Skipping Cert: {name}")
-                    rows.append(row)
-                    continue
-                local_tz = tz.tzlocal()
-                utc_tz = tz.tzutc()
-                notBefore_utc = parser.parse(notBefore)
-                notBefore_local = notBefore_utc.astimezone(local_tz)
-
-                notAfter_utc = parser.parse(notAfter)
-                notAfter_local = notAfter_utc.astimezone(local_tz)
-                if localtime:
-                    notAfter = notAfter_local.strftime(date_time_format)
-                    notBefore = notBefore_local.strftime(date_time_format)
-                else:
-                    notAfter = notAfter_utc.strftime(date_time_format)
-                    notBefore = notBefore_utc.strftime(date_time_format)
-
-                is_expired = notAfter_utc <= datetime.now().astimezone(utc_tz)
-                if is_expired:
-                    time_since_expiration = datetime.utcnow().replace(tzinfo=utc_tz) - notAfter_utc
-                    if days_only:
-                        time_since_expiration = time_since_expiration.days
-                    else:
-                        time_since_expiration = str(time_since_expiration)
-                    time_until_expiration = 0
-                else:
-                    time_until_expiration = notAfter_utc - datetime.utcnow().replace(tzinfo=utc_tz)
-                    if days_only:
-                        time_until_expiration = time_until_expiration.days
-                    else:
-                        time_until_expiration = str(time_until_expiration)
-                    time_since_expiration = 0
-                row.extend(
-                    [
-                        str(serial_number),
-                        subject,
-                        sans,
-                        signature_algorithm,
-                        notBefore,
-                        notAfter,
-                        issuer,
-                        str(is_expired),
-                        time_since_expiration,
-                        time_until_expiration
-                    ]
-                )
-                rows.append(row)
-                sleep(delay)
+    )
+    cache = None if no_cache else _load_cert_audit_cache()
 
+    # Rows are written to out_file as each appliance's audit completes,
+    # they are only kept in memory when needed for the web response
+    rows = [header_row]
     if extension.lower() == ".csv":
-        with open(out_file, "w", newline="") as fout:
-            writer = csv.writer(fout)
-            writer.writerows(rows)
-    elif extension.lower() == ".xlsx":
-        wb = openpyxl.Workbook()
-        ws = wb.active
-        for row in rows:
-            try:
-                ws.append(row)
-            except:
-                print("Error Adding certificate: '{}'".format(row))
-        wb.save(out_file)
+        fout = open(out_file, "w", newline="")
+        append = csv.writer(fout).writerow
     else:
-        # This should not happen
-        print("ERROR: out_file must have an xlsx or csv file extension.")
-        raise ValueError("ERROR: out_file must have an xlsx or csv file extension.")
+        wb = openpyxl.Workbook(write_only=True)
+        ws = wb.create_sheet("CertAudit")
+        append = ws.append
+
+    def write_row(row):
+        try:
+            append(row)
+        except:
+            print("Error Adding certificate: '{}'".format(row))
+
+    try:
+        write_row(header_row)
+        # Appliances are audited concurrently, but each appliance's requests
+        # are still issued one at a time (with delay between them) because
+        # they share the appliance's request object and credentials
+        with ThreadPoolExecutor(max_workers=_max_workers(env)) as executor:
+            for appliance_rows, output in executor.map(
+                    lambda appliance: _audit_appliance_certs(
+                        appliance,
+                        domains,
+                        delay,
+                        date_time_format,
+                        localtime,
+                        days_only,
+                        cache,
+                        web,
+                        logger),
+                    env.appliances):
+                # Each appliance's progress is printed as a block, in
+                # appliance order, so output from the workers does not
+                # interleave
+                print(output, end="")
+                for row in appliance_rows:
+                    write_row(row)
+                if web:
+                    rows.extend(appliance_rows)
+    finally:
+        if extension.lower() == ".csv":
+            fout.close()
+        else:
+            wb.save(out_file)
+        if cache is not None:
+            _save_cert_audit_cache(cache)
     # wb.save(out_file)
     if not web:
         print("\n\nCertificate Report (available at {}):".format(os.path.abspath(out_file)))
@@ -284,6 +232,262 @@ DO NOT USE.__"""
                 util.render_history(env))
 
 
+def _load_cert_audit_cache():
+    try:
+        with open(CERT_AUDIT_CACHE_FILE, "r") as fin:
+            return json.load(fin)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_cert_audit_cache(cache):
+    os.makedirs(os.path.dirname(CERT_AUDIT_CACHE_FILE), exist_ok=True)
+    with open(CERT_AUDIT_CACHE_FILE, "w") as fout:
+        json.dump(cache, fout)
+
+
+def _enabled_config_objects(config, _class):
+    """Returns the enabled objects of class _class in the get-config
+    response config. The response is parsed incrementally, so the
+    disabled objects are freed as soon as they are seen."""
+    return [
+        node for node in config.iterconfig(_class)
+        if node.findtext("mAdminState") == "enabled"
+    ]
+
+
+def _max_workers(env):
+    return max(1, min(MAX_WORKERS, len(env.appliances)))
+
+
+def _audit_appliance_certs(appliance,
+                           domains,
+                           delay,
+                           date_time_format,
+                           localtime,
+                           days_only,
+                           cache,
+                           web,
+                           logger):
+    """Audit the enabled CryptoCertificates in domains on appliance,
+    returns a list of rows and the progress output for the CLI"""
+    rows = []
+    out = io.StringIO()
+    logger.info("Checking appliance {}".format(appliance.hostname))
+    if not web:
+        print(appliance.hostname, file=out)
+    _domains = domains
+    if "all-domains" in domains:
+        _domains = appliance.domains
+    # Expiration is measured against the time the appliance's audit
+    # started rather than re-reading the clock for every certificate
+    now_utc = datetime.now(UTC_TZ)
+    for domain in _domains:
+        logger.info("In domain {}".format(domain))
+        if not web:
+            print("\t", domain, file=out)
+        config = appliance.get_config("CryptoCertificate", domain=domain, persisted=False)
+        # Filter out disabled objects because the results won't change,
+        # but we will perform less network traffic
+        certs = _enabled_config_objects(config, "CryptoCertificate")
+
+        modified_times = {}
+        if cache is not None and certs:
+            modified_times = _get_modified_times(
+                appliance,
+                domain,
+                [cert.findtext("Filename") or "" for cert in certs],
+                logger)
+
+        for cert in certs:
+            row = _audit_one_cert(appliance,
+                                  domain,
+                                  cert,
+                                  now_utc,
+                                  delay,
+                                  date_time_format,
+                                  localtime,
+                                  days_only,
+                                  cache,
+                                  modified_times,
+                                  web,
+                                  out,
+                                  logger)
+            rows.append(row)
+    return rows, out.getvalue()
+
+
+def _parse_timestamp(value):
+    """Parse a timestamp from the certificate details. The appliance
+    reports ISO 8601 timestamps which datetime.fromisoformat handles
+    much faster than dateutil, which is kept for anything else."""
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return parser.parse(value)
+
+
+def _normalize_filename(filename):
+    return COLON_SLASHES.sub(":///", filename)
+
+
+def _get_modified_times(appliance, domain, filenames, logger):
+    """Returns a dict mapping the normalized path of each file in the
+    locations referenced by filenames to its modified timestamp. This
+    takes one get-filestore request per location"""
+    modified_times = {}
+    locations = {f"{filename.split(':')[0]}:" for filename in filenames if ":" in filename}
+    for location in locations:
+        try:
+            filestore = appliance.get_filestore(domain=domain, location=location)
+        except Exception:
+            logger.exception(f"Unable to list {location} in {domain}, cached details will not be used")
+            continue
+        _location = filestore.xml.find(datapower.FILESTORE_XPATH)
+        if _location is None:
+            continue
+        for directory in [_location] + _location.findall(".//directory"):
+            dir_name = directory.get("name")
+            for _file in directory.iterfind("./file"):
+                path = _normalize_filename(f"{dir_name}/{_file.get('name')}")
+                modified_times[path] = _file.findtext("modified")
+    return modified_times
+
+
+def _audit_one_cert(appliance,
+                    domain,
+                    cert,
+                    now_utc,
+                    delay,
+                    date_time_format,
+                    localtime,
+                    days_only,
+                    cache,
+                    modified_times,
+                    web,
+                    out,
+                    logger):
+    """Audit a single CryptoCertificate, returns a row for the report.
+    If the details of the certificate cannot be retrieved, the row
+    contains only the information found in its configuration.
+
+    If cache is not None, the certificate's details are taken from it
+    when its file has not been modified since they were cached,
+    otherwise they are retrieved from the appliance and cached.
+    Progress is printed to out."""
+    logger.info("Exporting cert {}".format(cert))
+    name = cert.get("name")
+    try:
+        filename = cert.find("Filename").text
+    except AttributeError:
+        # There is no Filename element
+        print(f"Skipping cert: {cert}", file=out)
+        logger.warning(f"The certificate {name} has no Filename, it is being skipped")
+        return (appliance.hostname, domain, name)
+    # _filename = name
+    password_alias = cert.find("Alias")
+    if password_alias is not None:
+        password_alias = password_alias.text
+    if not web:
+        print("\t\t", name, file=out)
+    row = (appliance.hostname, domain, name, password_alias, filename)
+
+    cache_key = f"{appliance.hostname}|{domain}|{name}"
+    modified = modified_times.get(_normalize_filename(filename))
+    cached = cache.get(cache_key) if cache is not None else None
+    if (cached is not None
+            and modified is not None
+            and cached["filename"] == filename
+            and cached["modified"] == modified):
+        logger.info(f"Using cached details for cert {name}")
+        serial_number = cached["serial_number"]
+        subject = cached["subject"]
+        sans = cached["sans"]
+        signature_algorithm = cached["signature_algorithm"]
+        notBefore = cached["notBefore"]
+        notAfter = cached["notAfter"]
+        issuer = cached["issuer"]
+    else:
+        # There is no batched form of this request, do-view-certificate-details
+        # takes a single certificate-object and a SOMA request can only carry
+        # one operation, so the details are retrieved one certificate at a time
+        try:
+            details = appliance.get_certificate_details(
+                    domain=domain,
+                    certificate_name=name,
+                )
+        except Exception as exception:
+            logger.exception(f"An exception has occurred. The certificate {name} is being skipped and the error is being ignored")
+            if not web:
+                print(f"Skipping Cert: {name}, exception: {exception}", file=out)
+            return row
+        finally:
+            sleep(delay)
+        try:
+            certificate_details = CERTIFICATE_DETAILS(details.xml)[0]
+            subject = certificate_details.findtext("{*}Subject")
+            issuer = certificate_details.findtext("{*}Issuer")
+            serial_number = certificate_details.findtext("{*}SerialNumber")
+            signature_algorithm = certificate_details.findtext("{*}SignatureAlgorithm")
+            notBefore = certificate_details.findtext("{*}NotBefore")
+            notAfter = certificate_details.findtext("{*}NotAfter")
+            if None in (subject, issuer, serial_number, signature_algorithm, notBefore, notAfter):
+                raise ValueError("Missing field in CertificateDetails")
+        except (IndexError, ValueError, SyntaxError) as exception:
+            # IndexError: no CertificateDetails, ValueError: a missing field,
+            # SyntaxError: the response is not well-formed XML
+            logger.warning(f"Could not parse details for cert {name}, skipping: {exception!r}")
+            logger.debug(f"Received response {details}", exc_info=True)
+            if not web:
+                print(f"Skipping Cert: {name}, details: {details}", file=out)
+            return row
+        sans = ',\r\n'.join(
+            item.text or "" for item in certificate_details.iterfind(SUBJECT_ALT_NAMES)
+        )
+        if cache is not None and modified is not None:
+            cache[cache_key] = {
+                "filename": filename,
+                "modified": modified,
+                "serial_number": serial_number,
+                "subject": subject,
+                "sans": sans,
+                "signature_algorithm": signature_algorithm,
+                "notBefore": notBefore,
+                "notAfter": notAfter,
+                "issuer": issuer,
+            }
+    notBefore_utc = _parse_timestamp(notBefore)
+    notAfter_utc = _parse_timestamp(notAfter)
+    if localtime:
+        notAfter = notAfter_utc.astimezone(LOCAL_TZ).strftime(date_time_format)
+        notBefore = notBefore_utc.astimezone(LOCAL_TZ).strftime(date_time_format)
+    else:
+        notAfter = notAfter_utc.strftime(date_time_format)
+        notBefore = notBefore_utc.strftime(date_time_format)
+
+    remaining = notAfter_utc - now_utc
+    is_expired = remaining <= timedelta(0)
+    if is_expired:
+        elapsed = -remaining
+        time_since_expiration = elapsed.days if days_only else str(elapsed)
+        time_until_expiration = 0
+    else:
+        time_until_expiration = remaining.days if days_only else str(remaining)
+        time_since_expiration = 0
+    return row + (
+        str(serial_number),
+        subject,
+        sans,
+        signature_algorithm,
+        notBefore,
+        notAfter,
+        issuer,
+        str(is_expired),
+        time_since_expiration,
+        time_until_expiration,
+    )
+
+
 @cli.command("cert-file-audit", category="certificates")
 def cert_file_audit(appliances=[],
                     credentials=[],
@@ -332,8 +536,7 @@ DO NOT USE.__"""
         if not web:
             print("Must specify out_file")
         sys.exit(2)
-    if not os.path.exists(os.path.dirname(out_file)):
-        os.makedirs(os.path.dirname(out_file))
+    os.makedirs(os.path.dirname(out_file), exist_ok=True)
     locations = ["cert:", "pubcert:", "sharedcert:"]
     check_hostname = not no_check_hostname
     env = datapower.Environment(appliances,
@@ -348,56 +551,23 @@ DO NOT USE.__"""
                   "size",
                   "modified"]
     rows = [header_row]
-
-    for appliance in env.appliances:
-        if not web:
-            print(appliance.hostname)
-        domain = "default"
-
-        for location in locations:
-            if not web:
-                print("\t{}".format(location))
-            filestore = appliance.get_filestore(domain=domain,
-                                                location=location)
-            _location = filestore.xml.find(datapower.FILESTORE_XPATH)
-            if _location is None:
-                continue
-            if _location.findall("./file") is not None:
-                for _file in _location.findall("./file"):
-                    dir_name = _location.get("name")
-                    filename = _file.get("name")
-                    if not web:
-                        print("\t\t{}".format(filename))
-                    size = _file.find("size").text
-                    modified = _file.find("modified").text
-                    rows.append([appliance.hostname,
-                                 domain,
-                                 dir_name,
-                                 filename,
-                                 size,
-                                 modified])
-            for directory in _location.findall(".//directory"):
-                dir_name = directory.get("name")
-                if not web:
-                    print("\t\t{}".format(dir_name))
-                for _file in directory.findall(".//file"):
-                    filename = _file.get("name")
-                    if not web:
-                        print("\t\t\t{}".format(filename))
-                    size = _file.find("size").text
-                    modified = _file.find("modified").text
-
-                    rows.append([appliance.hostname,
-                                 domain,
-                                 dir_name,
-                                 filename,
-                                 size,
-                                 modified])
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    ws.title = "CertFileAudit"
-    for row in rows:
-        ws.append(row)
+    # Rows are streamed into a write-only workbook as each appliance's
+    # audit completes
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet("CertFileAudit")
+    ws.append(header_row)
+
+    with ThreadPoolExecutor(max_workers=_max_workers(env)) as executor:
+        for appliance_rows, output in executor.map(
+                lambda appliance: _audit_appliance_cert_files(
+                    appliance,
+                    locations,
+                    web),
+                env.appliances):
+            print(output, end="")
+            for row in appliance_rows:
+                ws.append(row)
+            rows.extend(appliance_rows)
     wb.save(out_file)
     if not web:
         print_table(rows)
@@ -411,6 +581,56 @@ DO NOT USE.__"""
                util.render_history(env))
 
 
+def _audit_appliance_cert_files(appliance, locations, web):
+    """Audit the files in locations on appliance, returns a list of rows
+    and the progress output for the CLI"""
+    rows = []
+    out = io.StringIO()
+    if not web:
+        print(appliance.hostname, file=out)
+    domain = "default"
+
+    for location in locations:
+        if not web:
+            print("\t{}".format(location), file=out)
+        filestore = appliance.get_filestore(domain=domain,
+                                            location=location)
+        _location = filestore.xml.find(datapower.FILESTORE_XPATH)
+        if _location is None:
+            continue
+        dir_name = _location.get("name")
+        for _file in _location.iterfind("./file"):
+            filename = _file.get("name")
+            if not web:
+                print("\t\t{}".format(filename), file=out)
+            size = _file.find("size").text
+            modified = _file.find("modified").text
+            rows.append([appliance.hostname,
+                         domain,
+                         dir_name,
+                         filename,
+                         size,
+                         modified])
+        for directory in _location.iterfind(".//directory"):
+            dir_name = directory.get("name")
+            if not web:
+                print("\t\t{}".format(dir_name), file=out)
+            for _file in directory.iterfind(".//file"):
+                filename = _file.get("name")
+                if not web:
+                    print("\t\t\t{}".format(filename), file=out)
+                size = _file.find("size").text
+                modified = _file.find("modified").text
+
+                rows.append([appliance.hostname,
+                             domain,
+                             dir_name,
+                             filename,
+                             size,
+                             modified])
+    return rows, out.getvalue()
+
+
 @cli.command("export-certs", category="certificates")
 def export_certs(appliances=[],
                  credentials=[],
@@ -468,96 +688,106 @@ DO NOT USE.__"""
                                 timeout,
                                 check_hostname=check_hostname)
 
-    for appliance in env.appliances:
-        logger.info("Checking appliance {}".format(appliance.hostname))
-        if not web:
-            print(appliance.hostname)
-
-        _domains = domains
-        if "all-domains" in domains:
-            _domains = appliance.domains
-
-        for domain in _domains:
-            logger.info("In domain {}".format(domain))
-            if not web:
-                print("\t", domain)
-
-            # Get a list of all certificates in this domain
-            config = appliance.get_config("CryptoCertificate", domain=domain)
-            certs = [x for x in config.xml.findall(datapower.CONFIG_XPATH)]
-
-            # Filter out disabled objects because the results won't change,
-            # but we will perform less network traffic
-            certs = [x for x in certs if x.find("mAdminState").text == "enabled"]
-            if not certs:
-                continue
-
-            # Create a directory structure $out_dir/hostname/domain
-            dir_name = os.path.join(out_dir, appliance.hostname, domain)
-            if not os.path.exists(dir_name):
-                os.makedirs(dir_name)
+    with ThreadPoolExecutor(max_workers=_max_workers(env)) as executor:
+        # Any exception raised in a worker is re-raised here
+        for output in executor.map(
+                lambda appliance: _export_appliance_certs(
+                    appliance,
+                    domains,
+                    out_dir,
+                    web,
+                    logger),
+                env.appliances):
+            print(output, end="")
+    if web:
+        return (util.render_see_download_table({k.hostname: "" for k in env.appliances},
+                                              "export-certs"),
+               util.render_history(env))
 
-            for cert in certs:
-                logger.info("Exporting cert {}".format(cert))
 
-                # Get filename as it will appear locally
-                filename = cert.find("Filename").text
-                out_file = re.sub(r":[/]*", "/", filename)
-                out_file = out_file.split("/")
-                out_file = os.path.join(dir_name, *out_file)
+def _export_appliance_certs(appliance, domains, out_dir, web, logger):
+    """Export the enabled CryptoCertificates in domains on appliance
+    to out_dir, returns the progress output for the CLI"""
+    out = io.StringIO()
+    logger.info("Checking appliance {}".format(appliance.hostname))
+    if not web:
+        print(appliance.hostname, file=out)
 
-                # extract directory name as it will appear locally
-                _out_dir = out_file.split(os.path.sep)[:-1]
-                _out_dir = os.path.join(*_out_dir)
-                # Create the directory if it doesn't exist
-                if not os.path.exists(_out_dir):
-                    os.makedirs(_out_dir)
+    _domains = domains
+    if "all-domains" in domains:
+        _domains = appliance.domains
 
-                name = cert.get("name")
+    for domain in _domains:
+        logger.info("In domain {}".format(domain))
+        if not web:
+            print("\t", domain, file=out)
+
+        # Get a list of all certificates in this domain
+        config = appliance.get_config("CryptoCertificate", domain=domain)
+        # Filter out disabled objects because the results won't change,
+        # but we will perform less network traffic
+        certs = _enabled_config_objects(config, "CryptoCertificate")
+        if not certs:
+            continue
+
+        # Create a directory structure $out_dir/hostname/domain
+        dir_name = os.path.join(out_dir, appliance.hostname, domain)
+        os.makedirs(dir_name, exist_ok=True)
+        created_dirs = {dir_name}
+
+        for cert in certs:
+            logger.info("Exporting cert {}".format(cert))
+
+            # Get filename as it will appear locally
+            filename = cert.find("Filename").text
+            out_file = os.path.join(
+                dir_name, *COLON_SLASHES.sub("/", filename).split("/"))
+            _out_dir = os.path.dirname(out_file)
+            # Create the directory if it doesn't exist
+            if _out_dir not in created_dirs:
+                os.makedirs(_out_dir, exist_ok=True)
+                created_dirs.add(_out_dir)
+
+            name = cert.get("name")
+            if not web:
+                print("\t\t", name, file=out)
+            # The export, retrieval and deletion are issued one after
+            # another, requests to the same appliance are never concurrent
+            appliance.CryptoExport(domain=domain,
+                                   ObjectType="cert",
+                                   ObjectName=name,
+                                   OutputFilename=name)
+            # TODO: Test export and handle failure
+            logger.info("Finished exporting cert {}".format(cert))
+            try:
+                logger.info(
+                    "Retrieving file temporary:///{}".format(name))
+                cert = appliance.getfile(domain,
+                                         "temporary:///{}".format(name))
+                logger.info(
+                    "Finished retrieving file temporary:///{}".format(
+                        name))
+                logger.info(
+                    "Attempting to delete file temporary:///{}".format(
+                        name))
+                appliance.DeleteFile(domain=domain,
+                                     File="temporary:///{}".format(name))
+                logger.info(
+                    "Finished deleting file temporary:///{}".format(name))
+            except:
+                logger.exception("An unhandled exception has occurred")
                 if not web:
-                    print("\t\t", name)
-                export = appliance.CryptoExport(domain=domain,
-                                                ObjectType="cert",
-                                                ObjectName=name,
-                                                OutputFilename=name)
-                # TODO: Test export and handle failure
-                logger.info("Finished exporting cert {}".format(cert))
-                try:
-                    logger.info(
-                        "Retrieving file temporary:///{}".format(name))
-                    cert = appliance.getfile(domain,
-                                             "temporary:///{}".format(name))
-                    logger.info(
-                        "Finished retrieving file temporary:///{}".format(
-                            name))
-                    logger.info(
-                        "Attempting to delete file temporary:///{}".format(
-                            name))
-                    appliance.DeleteFile(domain=domain,
-                                         File="temporary:///{}".format(name))
-                    logger.info(
-                        "Finished deleting file temporary:///{}".format(name))
-                except:
-                    logger.exception("An unhandled exception has occurred")
-                    if not web:
-                        print("SKIPPING CERT")
-                    continue
-                cert = etree.fromstring(cert)
-                with open(out_file, "w") as fout:
-                    _contents = insert_newlines(cert.find("certificate").text)
-                    contents = "{}\n{}\n{}\n".format(
-                        "-----BEGIN CERTIFICATE-----",
-                        _contents,
-                        "-----END CERTIFICATE-----")
-                    fout.write(contents)
-    if web:
-        return (util.render_see_download_table({k.hostname: "" for k in env.appliances},
-                                              "export-certs"),
-               util.render_history(env))
+                    print("SKIPPING CERT", file=out)
+                continue
+            cert = etree.fromstring(cert)
+            with open(out_file, "w") as fout:
+                fout.write(to_pem(cert.find("certificate").text))
+    return out.getvalue()
 
 
+@lru_cache(maxsize=None)
 def get_data_file(f):
-    return resource_string(__name__, 'docroot/{}'.format(f)).decode()
+    return files(__package__).joinpath('docroot', f).read_text()
 
 
 class WebPlugin(Plugin):
@@ -13,6 +13,20 @@
 # along with MAST.  If not, see <https://www.gnu.org/licenses/>.
 #
 # Copyright 2015-2024, McIndi Solutions, All rights reserved.
+import re
+from functools import lru_cache
+
+
+@lru_cache(maxsize=None)
+def _every_re(every):
+    # Matches each run of every characters which is followed by more
+    # characters, so no trailing newline is added
+    return re.compile(r"(.{%d})(?=.)" % every, re.DOTALL)
+
 
 def insert_newlines(string, every=64):
-    return '\n'.join(string[i:i+every] for i in range(0, len(string), every))
+    return _every_re(every).sub("\\1\n", string)
+
+
+def to_pem(string, label="CERTIFICATE"):
+    return f"-----BEGIN {label}-----\n{insert_newlines(string)}\n-----END {label}-----\n"
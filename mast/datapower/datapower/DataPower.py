@@ -539,6 +539,49 @@ class ConfigResponse(DPResponse):
                     self._dict[name][n.tag] = n.text
         return self._dict
 
+    def iterconfig(self, _class=None):
+        """
+        _method_: `mast.datapower.datapower.ConfigResponse.iterconfig(self, _class=None)`
+
+        Description:
+
+        Iterate over the configuration objects in the response (optionally
+        only those of class `_class`) without building the whole tree.
+        Each object is removed from the tree when the next one is
+        requested, so only the objects which the caller keeps a
+        reference to stay in memory.
+
+        If the response has already been parsed (ie. `self.xml` was
+        accessed) the objects are taken from the parsed tree instead.
+
+        Returns:
+
+        A generator of `lxml.etree.Element`s
+
+        Usage:
+
+            :::python
+            >>> resp = dp.get_config("CryptoCertificate")
+            >>> for cert in resp.iterconfig("CryptoCertificate"):
+            ...     print(cert.get("name"))
+
+        Parameters:
+
+        * `_class`: If provided, only objects of this class are returned
+        """
+        if hasattr(self, "_xml"):
+            yield from self._xml.iterfind(CONFIG_XPATH + (_class or "*"))
+            return
+        config_tag = "{{{}}}config".format(MGMT_NAMESPACE)
+        for _, node in etree.iterparse(BytesIO(self.text.encode()),
+                                       events=("end",),
+                                       tag=_class):
+            parent = node.getparent()
+            if parent is None or parent.tag != config_tag:
+                continue
+            yield node
+            parent.remove(node)
+
 logger = logging.getLogger("DataPower")
 logger.addHandler(logging.NullHandler())
 
@@ -13,9 +13,17 @@
 # along with MAST.  If not, see <https://www.gnu.org/licenses/>.
 #
 # Copyright 2015-2024, McIndi Solutions, All rights reserved.
+import ssl
+import atexit
 import base64
+import urllib3
+import requests
+import http.cookiejar
+from io import BytesIO
 from lxml import etree
+from functools import lru_cache
 from mast.util import _s, _b
+from requests.adapters import HTTPAdapter
 import urllib.request, urllib.error, urllib.parse
 # from .dpSOMALib import nsmap as NSMAP
 
@@ -26,6 +34,80 @@ NSMAP = {
     # 'dp': 'http://www.datapower.com/schemas/management',
 }
 
+USER_AGENT = "Python-urllib/%s" % urllib.request.__version__
+
+# Connections to the appliances are kept open between requests so every
+# request doesn't pay for a new TLS handshake. POOL_CONNECTIONS is the
+# number of appliances connections are kept to, POOL_MAXSIZE the number
+# of idle connections kept to each appliance (it matches the worker
+# threads used by the status, environment and crypto modules)
+POOL_CONNECTIONS = 32
+POOL_MAXSIZE = 16
+
+# Not checking the appliance's certificate is requested explicitly
+# (--no-check-hostname), so don't warn about it on every request
+urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+
+@lru_cache(maxsize=None)
+def _ssl_context(secure):
+    context = ssl.create_default_context()
+    if not secure:
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+    return context
+
+
+class _SSLContextAdapter(HTTPAdapter):
+    """HTTPAdapter verifying appliances with context (the system's
+    trust store, as urllib did) rather than requests' own CA bundle"""
+    def __init__(self, context, **kwargs):
+        self._context = context
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs["ssl_context"] = self._context
+        return super().init_poolmanager(*args, **kwargs)
+
+    def proxy_manager_for(self, proxy, **proxy_kwargs):
+        proxy_kwargs["ssl_context"] = self._context
+        return super().proxy_manager_for(proxy, **proxy_kwargs)
+
+
+class _BasicAuth(requests.auth.AuthBase):
+    """Basic auth with credentials which are already base64 encoded,
+    taking precedence over any .netrc entry for the appliance"""
+    def __init__(self, credentials):
+        self.credentials = credentials
+
+    def __call__(self, request):
+        request.headers["Authorization"] = "Basic %s" % (self.credentials)
+        return request
+
+
+@lru_cache(maxsize=None)
+def _session(secure):
+    """Returns the requests.Session used to talk to appliances with
+    (secure=True) or without certificate verification. Each request
+    carries its own credentials, so no cookies are kept"""
+    session = requests.Session()
+    session.cookies.set_policy(
+        http.cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+    adapter = _SSLContextAdapter(
+        _ssl_context(secure),
+        pool_connections=POOL_CONNECTIONS,
+        pool_maxsize=POOL_MAXSIZE)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+@atexit.register
+def close_connections():
+    """Closes the connections kept open to the appliances"""
+    for secure in (True, False):
+        _session(secure).close()
+
 
 # Custom exceptions
 class InvalidTestCaseFormat(Exception):
@@ -367,17 +449,27 @@ class Request(object):
             for authentication and authorization. Currently only basic auth is
             supported.
         """
-        import ssl
-        context = ssl.create_default_context()
-        if not secure:
-            context.check_hostname = False
-            context.verify_mode = ssl.CERT_NONE
         xml = etree.tostring(self.request_xml.getroot(), encoding="UTF-8")
-        req = urllib.request.Request(url=self._url, data=xml)
         creds = _s(self._credentials.strip())
-        req.add_header('Authorization', 'Basic %s' % (creds))
-        response_xml = urllib.request.urlopen(req, timeout=self._timeout, context=context)
-        response_xml = response_xml.read()
+        headers = {
+            "Content-Type": "application/x-www-form-urlencoded",
+            "User-Agent": USER_AGENT,
+        }
+        try:
+            # Proxies (e.g. https_proxy and no_proxy) are taken from the
+            # environment, as urllib did. A request is never resent once
+            # it may have reached the appliance
+            response = _session(secure).post(
+                self._url, data=xml, headers=headers, auth=_BasicAuth(creds),
+                timeout=self._timeout, verify=secure)
+        except requests.RequestException as e:
+            raise urllib.error.URLError(e)
+        response_xml = response.content
+        if not response.ok:
+            # Callers expect the errors raised by urllib
+            raise urllib.error.HTTPError(
+                self._url, response.status_code, response.reason,
+                response.headers, BytesIO(response_xml))
         return response_xml
 
     ## Magic Methods
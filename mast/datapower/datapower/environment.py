@@ -13,11 +13,19 @@
 # along with MAST.  If not, see <https://www.gnu.org/licenses/>.
 #
 # Copyright 2015-2024, McIndi Solutions, All rights reserved.
+from concurrent.futures import ThreadPoolExecutor
 from mast.util import _s
 from mast.xor import xordecode
 from mast.config import get_config
 from .DataPower import DataPower, STATUS_XPATH
 
+# The most appliances perform_concurrent_action talks to at once. The
+# worker threads live as long as the process, since each keeps its own
+# open connections to the appliances (see WSClientLib), so later calls
+# reuse them instead of repeating the TLS handshake
+MAX_WORKERS = 16
+_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS)
+
 
 def initialize_environments():
     """Initializes a global variable (module level) environments which
@@ -133,27 +141,63 @@ class Environment(object):
             responses[appliance.hostname] = getattr(appliance, func)(**kwargs)
         return responses
 
+    def perform_concurrent_action(self, func, **kwargs):
+        """Like perform_action, but calls func on up to MAX_WORKERS
+        appliances at once. Each appliance has its own connection, so
+        this is safe as long as func only acts on its own appliance."""
+        if not hasattr(self, 'appliances') or not self.appliances:
+            raise IndexError("appliances not defined in environment")
+        for appliance in self.appliances:
+            if not hasattr(appliance, func):
+                raise ValueError(
+                    "Method %s does not exist in DataPower class" % (func))
+        results = list(_executor.map(
+            lambda appliance: getattr(appliance, func)(**kwargs),
+            self.appliances))
+        responses = {}
+        for appliance, result in zip(self.appliances, results):
+            responses[appliance.hostname] = result
+        return responses
+
     def common_config(self, _class):
         """Find configuration objects across the environment which
         have the same name and object class. This method does not
         compare the configuration just the fact that an object of said
         type exists with the same name across the environment.
         """
+        return self.common_configs([_class])[_class]
+
+    def common_configs(self, classes, concurrent=False):
+        """Like common_config, but for each of the object classes in
+        classes, retrieving the object status from each appliance only
+        once. Returns a dict mapping each class to the set of names
+        common to the environment.
+
+        If concurrent is True the appliances are queried through
+        perform_concurrent_action rather than one after another.
+        """
         kwargs = {'provider': 'ObjectStatus'}
-        responses = self.perform_action("get_status", **kwargs)
+        if concurrent:
+            responses = self.perform_concurrent_action("get_status", **kwargs)
+        else:
+            responses = self.perform_action("get_status", **kwargs)
 
         xpath = STATUS_XPATH + "ObjectStatus"
-        sets = []
+        sets = {_class: [] for _class in classes}
         for host, response in list(responses.items()):
+            found = {_class: set() for _class in sets}
             try:
-                sets.append(
-                    set([
-                        _.find('Name').text
-                        for _ in response.xml.findall(xpath)
-                        if _.find("Class").text == _class]))
+                for node in response.xml.findall(xpath):
+                    names = found.get(node.find("Class").text)
+                    if names is not None:
+                        names.add(node.find('Name').text)
             except AttributeError:
-                sets.append(set([]))
-        return sets[0].intersection(*sets[1:])
+                found = {_class: set() for _class in sets}
+            for _class, names in found.items():
+                sets[_class].append(names)
+        return {
+            _class: _sets[0].intersection(*_sets[1:])
+            for _class, _sets in sets.items()}
 
 ###############################################################################
 # TODO: Fix this, right now performing async actions causes errors on windows
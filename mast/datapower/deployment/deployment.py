@@ -31,9 +31,9 @@ from mast.datapower.deployment.git_deploy import git_deploy
 from mast.plugin_utils.plugin_utils import render_results_table, render_history
 from mast.plugins.web import Plugin
 from mast.timestamp import Timestamp
-from pkg_resources import resource_string
+from importlib.resources import files
 from mast.logging import make_logger, logged
-from functools import partial, update_wrapper
+from functools import partial, update_wrapper, lru_cache
 import mast.plugin_utils.plugin_utils as util
 import mast.plugin_utils.plugin_functions as pf
 
@@ -1085,8 +1085,9 @@ DO NOT USE.__"""
     if web:
         return output, history
 
+@lru_cache(maxsize=None)
 def get_data_file(f):
-    return resource_string(__name__, 'docroot/{}'.format(f)).decode()
+    return files(__package__).joinpath('docroot', f).read_text()
 
 
 cli.command('git-deploy', category='deployment')(git_deploy)
@@ -23,11 +23,11 @@ import flask
 from mast.cli import Cli
 import urllib.request, urllib.error, urllib.parse
 from mast.plugins.web import Plugin
-from pkg_resources import resource_string
+from importlib.resources import files
 import mast.datapower.datapower as datapower
 from mast.logging import make_logger, logged
 import mast.plugin_utils.plugin_utils as util
-from functools import partial, update_wrapper
+from functools import partial, update_wrapper, lru_cache
 import mast.plugin_utils.plugin_functions as pf
 
 
@@ -1445,8 +1445,9 @@ DO NOT USE.__"""
                 print(response)
 
 
+@lru_cache(maxsize=None)
 def get_data_file(f):
-    return resource_string(__name__, 'docroot/{}'.format(f)).decode()
+    return files(__package__).joinpath('docroot', f).read_text()
 
 
 class WebPlugin(Plugin):
@@ -18,7 +18,8 @@ import flask
 from mast.logging import logged
 from mast.plugins.web import Plugin
 from mast.datapower import datapower
-from pkg_resources import resource_string
+from importlib.resources import files
+from functools import lru_cache
 from mast.xor import xordecode, xorencode
 
 _appliances = {}
@@ -34,8 +35,9 @@ def _check_for_appliance(hostname, appliances):
     return False
 
 
+@lru_cache(maxsize=None)
 def get_data_file(f):
-    return resource_string(__name__, 'docroot/{}'.format(f)).decode()
+    return files(__package__).joinpath('docroot', f).read_text()
 
 
 class WebPlugin(Plugin):
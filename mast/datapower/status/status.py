@@ -15,11 +15,17 @@
 # Copyright 2015-2024, McIndi Solutions, All rights reserved.
 import os
 import flask
-from time import sleep
+import hashlib
+import threading
+from time import sleep, monotonic
+from io import BytesIO
+from lxml import etree
+from concurrent.futures import ThreadPoolExecutor
 from mast.plugins.web import Plugin
 from mast.timestamp import Timestamp
 from mast.datapower import datapower
-from pkg_resources import resource_string
+from importlib.resources import files
+from functools import lru_cache
 from mast.xor import xordecode, xorencode
 from mast.logging import make_logger, logged
 
@@ -35,18 +41,153 @@ PROVIDER_MAP = ({
     "SystemUsage.WorkList": datapower.STATUS_XPATH + 'SystemUsage/WorkList'
     })
 
-mast_home = os.environ["MAST_HOME"]
+# The status class and the element holding the metric for each provider
+PROVIDER_PREFIX = {
+    provider: provider.split(".")[0] for provider in PROVIDER_MAP
+}
+PROVIDER_LEAF = {
+    provider: provider.split(".")[1] for provider in PROVIDER_MAP
+}
 
+mast_home = os.environ["MAST_HOME"]
 
+MAX_WORKERS = 16
+
+# The dashboard polls status repeatedly with the same appliances, so the
+# Environments (and their DataPower objects) are kept for a while and the
+# worker threads, which hold the open connections to the appliances,
+# live as long as the process
+ENVIRONMENT_TTL = 60
+_environments = {}
+_environments_lock = threading.Lock()
+_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS)
+
+
+CREDENTIALS_TTL = 30
+_credentials = {}
+_credentials_lock = threading.Lock()
+
+
+def _decode_credentials(cookie, encoded):
+    """Returns the credentials in encoded decoded with the key derived
+    from the session cookie. The results are kept for a short time, since
+    the dashboard sends the same credentials with every poll"""
+    key = (cookie, tuple(encoded))
+    now = monotonic()
+    with _credentials_lock:
+        for _key, (_, expires) in list(_credentials.items()):
+            if expires < now:
+                del _credentials[_key]
+        if key in _credentials:
+            return _credentials[key][0]
+    xor_key = xorencode(cookie, key="_")
+    credentials = [xordecode(_.encode(), key=xor_key) for _ in encoded]
+    with _credentials_lock:
+        _credentials[key] = (credentials, now + CREDENTIALS_TTL)
+    return credentials
+
+
+def _get_environment(appliances, credentials, check_hostname):
+    """Returns an (Environment, Lock) pair for appliances. The lock
+    must be held while the Environment is in use since its DataPower
+    objects are not thread safe"""
+    key = (
+        tuple(appliances),
+        hashlib.sha256(
+            b"\0".join(
+                c if isinstance(c, bytes) else c.encode()
+                for c in credentials)
+        ).digest(),
+        check_hostname,
+    )
+    now = monotonic()
+    with _environments_lock:
+        for _key, (_, _, expires) in list(_environments.items()):
+            if expires < now:
+                del _environments[_key]
+        if key not in _environments:
+            env = datapower.Environment(
+                appliances,
+                credentials,
+                check_hostname=check_hostname)
+            _environments[key] = (env, threading.Lock(), None)
+        env, lock, _ = _environments[key]
+        _environments[key] = (env, lock, now + ENVIRONMENT_TTL)
+    return env, lock
+
+
+def _get_status(appliance, provider, logger):
+    try:
+        return appliance.get_status(provider)
+    except datapower.AuthenticationFailure:
+        # This is to handle an intermittent authentication failure
+        # sometimes issued by the DataPower. We will sleep 2
+        # seconds and try again
+        sleep(2)
+        try:
+            return appliance.get_status(provider)
+        except:
+            logger.exception(
+                "An unhandled exception occurred during execution")
+            raise
+    except:
+        logger.exception(
+            "An unhandled exception occurred during execution")
+        raise
+
+
+def _get_metrics(appliance, providers, logger):
+    """Returns a dict mapping each of providers to its metric on
+    appliance"""
+    # There is no batched form of get-status, a SOMA request carries a
+    # single operation, so each status class is requested separately.
+    # Each is requested once (several metrics can come from the same
+    # class) and only a failed request is retried
+    statuses = {
+        _provider: _get_status(appliance, _provider, logger)
+        for _provider in dict.fromkeys(
+            PROVIDER_PREFIX[provider] for provider in providers)
+    }
+    leaves = {}
+    for provider in providers:
+        leaves.setdefault(PROVIDER_PREFIX[provider], set()).add(
+            PROVIDER_LEAF[provider])
+    values = {
+        _provider: _read_metrics(statuses[_provider], _provider, _leaves)
+        for _provider, _leaves in leaves.items()
+    }
+    return {
+        provider: values[PROVIDER_PREFIX[provider]][PROVIDER_LEAF[provider]]
+        for provider in providers
+    }
+
+
+def _read_metrics(status, provider, leaves):
+    """Returns a dict mapping each of leaves to the text of that child of
+    the provider element in status. The response is parsed incrementally
+    and parsing stops as soon as every leaf has been found"""
+    values = {}
+    for _, node in etree.iterparse(BytesIO(status.text.encode()),
+                                   events=("end",),
+                                   tag=leaves):
+        if node.getparent().tag == provider:
+            values[node.tag] = node.text
+            if len(values) == len(leaves):
+                break
+        node.clear()
+    return values
+
+
+@lru_cache(maxsize=None)
 def get_data_file(f):
-    return resource_string(__name__, 'docroot/{}'.format(f)).decode()
+    return files(__package__).joinpath('docroot', f).read_text()
 
 
 class WebPlugin(Plugin):
     def __init__(self):
         logger = make_logger("mast.status")
         global mast_home
-        logger.debug("found MAST_HOME: {}".format(mast_home))
+        logger.debug("found MAST_HOME: %s", mast_home)
         self.route = self.status
 
         config_file = os.path.join(
@@ -76,18 +217,13 @@ class WebPlugin(Plugin):
         check_hostname = "true" in flask.request.form.get(
             'check_hostname').lower()
         appliances = flask.request.form.getlist('appliances[]')
-        credentials = [xordecode(
-            _.encode(),
-            key=xorencode(
-                flask.request.cookies["9x4h/mmek/j.ahba.ckhafn"], key="_"))
-                for _ in flask.request.form.getlist('credentials[]')]
+        credentials = _decode_credentials(
+            flask.request.cookies["9x4h/mmek/j.ahba.ckhafn"],
+            flask.request.form.getlist('credentials[]'))
         if not appliances:
             return flask.abort(404)
 
-        env = datapower.Environment(
-            appliances,
-            credentials,
-            check_hostname=check_hostname)
+        env, lock = _get_environment(appliances, credentials, check_hostname)
 
         providers = flask.request.form.getlist("providers[]")
 
@@ -95,27 +231,13 @@ class WebPlugin(Plugin):
             "appliances": appliances,
             "time": t.short}
 
+        # Each appliance is polled in its own thread, but the providers
+        # for a single appliance are requested one at a time
+        with lock:
+            results = list(_executor.map(
+                lambda appliance: _get_metrics(appliance, providers, logger),
+                env.appliances))
+
         for provider in providers:
-            _provider = provider.split(".")[0]
-            resp[provider] = []
-            for appliance in env.appliances:
-                try:
-                    _status = appliance.get_status(_provider)
-                except datapower.AuthenticationFailure:
-                    # This is to handle an intermittent authentication failure
-                    # sometimes issued by the DataPower. We will sleep 2
-                    # seconds and try again
-                    sleep(2)
-                    try:
-                        return self.status()
-                    except:
-                        logger.exception(
-                            "An unhandled exception occurred during execution")
-                        raise
-                except:
-                    logger.exception(
-                        "An unhandled exception occurred during execution")
-                    raise
-                metric = _status.xml.find(PROVIDER_MAP[provider]).text
-                resp[provider].append(metric)
+            resp[provider] = [metrics[provider] for metrics in results]
         return flask.jsonify(resp)
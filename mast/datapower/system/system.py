@@ -33,8 +33,8 @@ from mast.plugins.web import Plugin
 from mast.logging import make_logger
 from mast.timestamp import Timestamp
 from mast.datapower import datapower
-from pkg_resources import resource_string
-from functools import partial, update_wrapper
+from importlib.resources import files
+from functools import partial, update_wrapper, lru_cache
 import mast.plugin_utils.plugin_utils as util
 import mast.plugin_utils.plugin_functions as pf
 from mast.datapower.backups import get_normal_backup
@@ -3867,8 +3867,9 @@ def _clean_error_reports(appliance, domain, backup, timestamp, out_dir):
         appliance.DeleteFile(domain="default", File=fqp)
 
 
+@lru_cache(maxsize=None)
 def get_data_file(f):
-    return resource_string(__name__, 'docroot/{}'.format(f)).decode()
+    return files(__package__).joinpath('docroot', f).read_text()
 
 
 class WebPlugin(Plugin):
@@ -44,24 +44,28 @@ Usage:
 
 import os
 import re
+import queue
+import atexit
 import logging
 import getpass
-from functools import wraps
+import itertools
+import threading
+from functools import wraps, lru_cache
 from mast.util import _s, _b
 from mast import __version__
 from mast.timestamp import Timestamp
-from logging.handlers import RotatingFileHandler
-from mast.config import get_configs_dict
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
+from mast.config import get_config_dict
 
 mast_home = os.environ["MAST_HOME"]
 
-config = get_configs_dict()
-config = config["logging.conf"]
-level = int(config["logging"]["level"])
-max_bytes = int(config["logging"]["max_bytes"])
-backup_count = int(config["logging"]["backup_count"])
-delay = bool(config["logging"]["delay"])
-propagate = bool(config["logging"]["propagate"])
+
+@lru_cache(maxsize=None)
+def _load_config():
+    """Returns the [logging] section of logging.conf, this is read on
+    the first call to make_logger rather than when this module is
+    imported"""
+    return get_config_dict("logging.conf")["logging"]
 
 
 filemode = "w"
@@ -74,49 +78,167 @@ _format = "; ".join((
     "'message'='%(message)s'"))
 t = Timestamp()
 
+# The loggers returned by make_logger, by name. This avoids taking the
+# logging module's lock in logging.getLogger every time make_logger is
+# called (which is on every call to a @logged function)
+_loggers = {}
+
 class RedactingFilter(logging.Filter):
 
-    def __init__(self):
-        super(RedactingFilter, self).__init__()
-        self._patterns = [
-            re.compile(r"(?i)'password'=[u]?'.*?'"),
-            re.compile(r"(?i)'password': u'.*?'"),
-            re.compile(r"(?i)'password', u'.*?'"),
-            re.compile(r"(?i)<password>.*?</password>"),
-            re.compile(r"(?i)\('credentials\[\]', u'.*?'\)"),
-            re.compile(r"(?i)'credentials': \[.*?\]"),
-        ]
+    # Every pattern below contains one of these, messages which contain
+    # neither (which is almost all of them) can skip the regex entirely
+    _triggers = ("password", "credentials")
+
+    # The patterns are shared by every instance (there is one per logger).
+    # They are matched as a single alternation, a multi-pattern engine
+    # such as Hyperscan isn't used because it isn't available on every
+    # platform MAST supports and redaction now runs on the log listener
+    # thread, off the path of the code doing the logging
+    _patterns = [
+        re.compile(r"(?i)'password'=[u]?'.*?'"),
+        re.compile(r"(?i)'password': u'.*?'"),
+        re.compile(r"(?i)'password', u'.*?'"),
+        re.compile(r"(?i)<password>.*?</password>"),
+        re.compile(r"(?i)\('credentials\[\]', u'.*?'\)"),
+        re.compile(r"(?i)'credentials': \[.*?\]"),
+    ]
+    _pattern = re.compile(
+        "|".join(
+            "(?:{})".format(pattern.pattern.replace("(?i)", "", 1))
+            for pattern in _patterns
+        ),
+        re.IGNORECASE,
+    )
 
     def filter(self, record):
         record.msg = self.redact(record.msg)
         if isinstance(record.args, dict):
             for k in list(record.args.keys()):
                 record.args[k] = self.redact(record.args[k])
-        else:
+        elif record.args:
             record.args = tuple(self.redact(arg) for arg in record.args)
         return True
 
     def redact(self, msg):
-        msg = isinstance(msg, str) and msg or str(msg)
-        for pattern in self._patterns:
-               msg = re.sub(pattern, "**REDACTED**", msg)
-        return msg
+        if not isinstance(msg, str):
+            msg = str(msg)
+        lower = msg.lower()
+        if not any(trigger in lower for trigger in self._triggers):
+            return msg
+        return self._pattern.sub("**REDACTED**", msg)
 
 class DelayedDirCreatingRotatingFileHandler(RotatingFileHandler):
+    # The directory is created when the file is first opened (so a process
+    # which never logs anything doesn't leave an empty directory behind),
+    # it only needs to be created once, not on every rollover
+    _directory_created = False
+
     def _open(self):
-        directory = os.path.dirname(self.baseFilename)
-        if not os.path.exists(directory):
-            os.makedirs(directory)
+        if not self._directory_created:
+            os.makedirs(os.path.dirname(self.baseFilename), exist_ok=True)
+            self._directory_created = True
         return super()._open()
 
+
+class _QueueHandler(QueueHandler):
+    """Puts records on the shared log queue along with the handler which
+    should emit them, so the filtering and file I/O is done by the
+    listener thread rather than the thread which logged the record"""
+
+    def __init__(self, target):
+        super().__init__(_queue)
+        self.target = target
+
+    def enqueue(self, record):
+        if not _listener_started:
+            # The listener isn't running (ie. during interpreter shutdown)
+            _listener.handle((self.target, record))
+        else:
+            self.queue.put_nowait((self.target, record))
+
+
+class _QueueListener(QueueListener):
+    def handle(self, item):
+        target, record = item
+        if record.levelno >= target.level:
+            target.handle(record)
+
+
+_queue = queue.SimpleQueue()
+_listener = _QueueListener(_queue)
+
+
+# Starting and stopping the listener is guarded by _listener_lock, since
+# the first loggers can be made from several threads at once and only one
+# listener thread may ever read the queue
+_listener_lock = threading.Lock()
+_listener_started = False
+
+
+def _start_listener_locked():
+    global _listener_started
+    if not _listener_started:
+        _listener.start()
+        _listener_started = True
+
+
+def _stop_listener_locked():
+    global _listener_started
+    if _listener_started:
+        _listener_started = False
+        _listener.stop()
+
+
+def _start_listener():
+    with _listener_lock:
+        _start_listener_locked()
+
+
+def _stop_listener():
+    with _listener_lock:
+        _stop_listener_locked()
+
+
+# The listener thread does not survive fork (ie. when daemonizing), so it
+# is stopped before forking, which also writes out anything still queued
+# (rather than the child inheriting it and writing it again), and is
+# started again in both processes. The lock is held across the fork so the
+# child can't inherit it locked by another thread
+_listener_was_running = False
+
+
+def _stop_listener_before_fork():
+    global _listener_was_running
+    _listener_lock.acquire()
+    _listener_was_running = _listener_started
+    _stop_listener_locked()
+
+
+def _restart_listener_after_fork():
+    try:
+        if _listener_was_running:
+            _start_listener_locked()
+    finally:
+        _listener_lock.release()
+
+
+atexit.register(_stop_listener)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(
+        before=_stop_listener_before_fork,
+        after_in_parent=_restart_listener_after_fork,
+        after_in_child=_restart_listener_after_fork,
+    )
+
+
 def make_logger(
         name,
-        level=level,
+        level=None,
         fmt=_format,
-        max_bytes=max_bytes,
-        backup_count=backup_count,
-        delay=delay,
-        propagate=propagate,
+        max_bytes=None,
+        backup_count=None,
+        delay=None,
+        propagate=None,
     ):
     """
     _function_: `mast.logging.make_logger(name, level=level, fmt=_format, filename=None, when=unit, interval=interval, propagate=propagate, backup_count=backup_count)`
@@ -129,7 +251,9 @@ def make_logger(
     level, filename, time unit, interval, backup count and
     whether to propagate messages to parent loggers (defined
     by dot seperated heirarchy ie in `mast.datapower`,
-    `datapower` is a logger with a parent logger of mast).
+    `datapower` is a logger with a parent logger of mast). Any of
+    `level`, `max_bytes`, `backup_count`, `delay` and `propagate` which
+    are left as `None` are taken from `logging.conf`.
 
     Parameters:
 
@@ -168,13 +292,30 @@ def make_logger(
         logger.debug("debug message")
     """
     global t
+    _logger = _loggers.get(name)
+    if _logger is not None and _logger.handlers:
+        return _logger
     _logger = logging.getLogger(name)
+    _loggers[name] = _logger
     if _logger.handlers:
         if len(_logger.handlers) >= 1:
             return _logger
 
+    # Any options which weren't provided come from logging.conf
+    config = _load_config()
+    if level is None:
+        level = int(config["level"])
+    if max_bytes is None:
+        max_bytes = int(config["max_bytes"])
+    if backup_count is None:
+        backup_count = int(config["backup_count"])
+    if delay is None:
+        delay = bool(config["delay"])
+    if propagate is None:
+        propagate = bool(config["propagate"])
+
     _logger.setLevel(level)
-    _formatter = logging.Formatter(fmt)
+    _formatter = logging.Formatter(fmt, style="%")
 
     pid = os.getpid()
     directory = os.path.join(
@@ -199,9 +340,10 @@ def make_logger(
     _handler.setFormatter(_formatter)
     _handler.setLevel(level)
     _handler.addFilter(RedactingFilter())
-    _logger.addHandler(_handler)
+    _start_listener()
+    _logger.addHandler(_QueueHandler(_handler))
     _logger.propagate = propagate
-    _logger.debug(f"Logger build complete: {_logger}")
+    _logger.debug("Logger build complete: %s", _logger)
     return _logger
 
 
@@ -218,7 +360,10 @@ def _format_args(args):
     coerced into a `str`, surrounded by single quotes and seperated by
     a comma.
     """
-    return ", ".join(("'" + repr(arg) + "'" for arg in args))
+    return ", ".join(map("'{!r}'".format, args))
+
+
+_BRACES_TABLE = str.maketrans("", "", "{}")
 
 
 def _format_kwargs(kwargs):
@@ -233,7 +378,15 @@ def _format_kwargs(kwargs):
     * `kwargs`: The keyword-arguments passed to the decorated function. They
     will be represented like `'key'='value',`
     """
-    return repr(kwargs).replace("{", "").replace("}", "").replace(": ", "=")
+    # This deliberately rewrites any nested dicts as well, so that
+    # RedactingFilter's 'password'='...' pattern also matches inside them
+    return repr(kwargs).translate(_BRACES_TABLE).replace(": ", "=")
+
+
+# Formatted arguments of recent @logged calls, see _format_arguments
+ARGUMENTS_CACHE_SIZE = 1024
+_arguments_cache = {}
+_IMMUTABLE_TYPES = frozenset((str, bytes, int, float, bool, type(None)))
 
 
 def _format_arguments(args, kwargs):
@@ -251,6 +404,21 @@ def _format_arguments(args, kwargs):
     * `kwargs`: The keyword-arguments passed to the decorated function. They
     will be represented like `'key'='value',`
     """
+    # Only calls made purely with immutable values can be cached, the
+    # repr of anything else (including self for methods) may change
+    cacheable = all(
+        type(value) in _IMMUTABLE_TYPES
+        for value in itertools.chain(args, kwargs.values())
+    )
+    if cacheable:
+        # The types are part of the key because ie. 1 == 1.0 == True
+        key = (
+            tuple((type(arg), arg) for arg in args),
+            tuple((k, type(v), v) for k, v in kwargs.items()),
+        )
+        arguments = _arguments_cache.get(key)
+        if arguments is not None:
+            return arguments
     arguments = ""
     if args:
         arguments += _format_args(args)
@@ -258,8 +426,20 @@ def _format_arguments(args, kwargs):
         if args:
             arguments += ", "
         arguments += _format_kwargs(kwargs)
+    if cacheable:
+        if len(_arguments_cache) >= ARGUMENTS_CACHE_SIZE:
+            _arguments_cache.clear()
+        _arguments_cache[key] = arguments
     return arguments
 
+_ESCAPE_TABLE = str.maketrans({
+    "\n": "",
+    "\r": "",
+    "'": "&apos;",
+    '"': "&quot;",
+})
+
+
 def _escape(string):
     """
     _function_: `mast.logging._escape(string)`
@@ -271,15 +451,7 @@ def _escape(string):
 
     * `string`: The string to escape
     """
-    return string.replace(
-        "\n", ""
-    ).replace(
-        "\r", ""
-    ).replace(
-        "'", "&apos;"
-    ).replace(
-        '"', "&quot;"
-    )
+    return string.translate(_ESCAPE_TABLE)
 
 
 def logged(name="mast"):
@@ -310,28 +482,31 @@ def logged(name="mast"):
         @wraps(func)
         def _wrapper(*args, **kwargs):
             logger = make_logger(name)
-            arguments = _format_arguments(args, kwargs)
-            logger.debug(
-                "Attempting to execute {}({})".format(
-                    func.__name__, arguments))
+            # Formatting the arguments and result can be expensive (they
+            # are often large XML responses), so only do it when the
+            # messages will actually be logged
+            debug = logger.isEnabledFor(logging.DEBUG)
+            if debug:
+                arguments = _format_arguments(args, kwargs)
+                logger.debug(
+                    "Attempting to execute %s(%s)", func.__name__, arguments)
             try:
                 result = func(*args, **kwargs)
             except:
                 logger.exception(
                     "An unhandled exception occurred while "
-                    "attempting to execute {}({})".format(
-                        func.__name__,
-                        arguments
-                    )
+                    "attempting to execute %s(%s)",
+                    func.__name__,
+                    arguments if debug else _format_arguments(args, kwargs),
                 )
                 raise
-            _result = _escape(repr(result))
-            msg = "Finished execution of {}({}). Result: {}".format(
-                func.__name__,
-                arguments,
-                _result
-            )
-            logger.debug(msg)
+            if debug:
+                logger.debug(
+                    "Finished execution of %s(%s). Result: %s",
+                    func.__name__,
+                    arguments,
+                    _escape(repr(result)),
+                )
             return result
         return _wrapper
     return _decorator
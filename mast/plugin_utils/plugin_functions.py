@@ -36,21 +36,43 @@ plugins into this single module.
 TODO: Documentation
 TODO: Test cases (unit testing)
 """
-import re
 import os
 import sys
+import random
+import shutil
+import hashlib
+import threading
+import traceback
+import urllib.parse
 import flask
 import inspect
 import zipfile
 import markdown
 from markupsafe import Markup
-import html.entities as html_entities
 from textwrap import dedent
+from time import monotonic
+from functools import lru_cache
+from itertools import chain
 from mast.config import get_config
 from mast.datapower.datapower import Environment
 from mast.xor import xordecode, xorencode
 from mast.timestamp import Timestamp
 from mast.logging import make_logger, logged
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+
+REQUEST_HISTORY_DIR = os.path.join(
+    "var", "www", "static", "tmp", "request_history")
+HISTORY_CHUNK_SIZE = 1 << 16
+COPY_BUFSIZE = 1 << 20
+# The FICLONE ioctl from linux/fs.h
+FICLONE = 0x40049409
+FORM_TTL = 60
+_forms = {}
+_forms_lock = threading.Lock()
 
 OBJECT_STATUS_ARGS = [
 	"AAAPolicy",
@@ -362,6 +384,7 @@ OBJECT_STATUS_ARGS = [
 	"ZHybridTargetControlService",
 	"ZosNSSClient",
 ]
+_OBJECT_STATUS_SET = frozenset(OBJECT_STATUS_ARGS)
 
 STATUS_PROVIDERS = [
     "ActiveUsers",
@@ -651,13 +674,24 @@ STATUS_PROVIDERS = [
     "ZosNSSstatus"
 ]
 
-def _zipdir(path, z):
+def _zipdir(path, z, _arcdir=None):
     """Create a zip file z of all files in path recursively"""
-    for root, _, files in os.walk(path):
-        for f in files:
-            filename = os.path.join(
-                *os.path.join(root, f).split(os.path.sep)[2:])
-            z.write(os.path.join(root, f), filename)
+    if not os.path.isdir(path):
+        # The action failed or returned before writing any output, which
+        # leaves an empty zip like os.walk did
+        return
+    if _arcdir is None:
+        # Names in the archive drop the first two components of path
+        _arcdir = os.path.sep.join(path.split(os.path.sep)[2:])
+    with os.scandir(path) as entries:
+        for entry in entries:
+            arcname = os.path.join(_arcdir, entry.name)
+            if entry.is_dir():
+                # Like os.walk, don't descend into symlinked directories
+                if not entry.is_symlink():
+                    _zipdir(entry.path, z, arcname)
+            else:
+                z.write(entry.path, arcname)
 
 
 def get_module(plugin):
@@ -667,40 +701,18 @@ def get_module(plugin):
     return getattr(module, plugin)
 
 
-def unescape(text):
-    """Removes HTML or XML character references and entities from a text string.
-    @param text The HTML (or XML) source text.
-    @return The plain text, as a Unicode string, if necessary.
-
-    This function was taken from:
-    http://effbot.org/zone/re-sub.htm#unescape-html
-
-    written by: Fredrik Lundh"""
-
-    def fixup(m):
-        text = m.group(0)
-        if text[:2] == "&#":
-            # character reference
-            try:
-                if text[:3] == "&#x":
-                    return chr(int(text[3:-1], 16))
-                else:
-                    return chr(int(text[2:-1]))
-            except ValueError:
-                pass
-        else:
-            # named entity
-            try:
-                text = chr(html_entities.name2codepoint[text[1:-1]])
-            except KeyError:
-                pass
-        return text  # leave as is
-    return re.sub(r"&#?\w+;", fixup, text)
-
-
-
 def html(plugin):
     """Return the html for plugin's tab"""
+    if flask.current_app.debug:
+        # Re-render in debug mode so template edits show up on reload
+        return _html_cached.__wrapped__(plugin)
+    return _html_cached(plugin)
+
+
+@lru_cache(maxsize=32)
+def _html_cached(plugin):
+    """Render the html for plugin's tab. The command list is static for
+    the life of the process, so the result is cached per plugin."""
     htm = []
     module = get_module(plugin.replace("mast.datapower.", ""))
     last_category = ''
@@ -709,41 +721,67 @@ def html(plugin):
     for category in sorted(command_list):
         # print(type(category))
         for index, item in enumerate(command_list[category]):
-            callable_name = item.__name__.replace('_', ' ')
+            # category and callable_name are names defined in the plugins
+            # themselves, so they are safe to render without escaping
+            callable_name = Markup(_label(item.__name__))
             if category != last_category:
                 htm.append(
                     flask.render_template(
-                        'categorylabel.html', category=category))
+                        'categorylabel.html', category=Markup(category)))
             htm.append(
                 flask.render_template(
                     'dynbutton.html', plugin=plugin, callable=callable_name))
             last_category = category
-    return unescape(flask.render_template(
-        'dynplugin.html', plugin=plugin, buttons=''.join(htm)))
+    return flask.render_template(
+        'dynplugin.html', plugin=plugin, buttons=Markup(''.join(htm)))
 
 
 def _get_arguments(plugin, fn_name):
     """Return a list of two-tuples containing the argument names and
     default values for function name and the actual function."""
+    arguments, item = _get_arguments_cached(plugin, fn_name)
+    return (list(arguments), item)
+
+
+@lru_cache(maxsize=None)
+def _get_command_index(plugin):
+    """Return a dict mapping the names of plugin's commands to the
+    commands themselves. The command list is built once at import, so
+    the index is built once per plugin."""
     module = get_module(plugin)
-    found = False
-    for category, items in module.cli._command_list.items():
-        if found:
-            break
+    index = {}
+    for items in module.cli._command_list.values():
         for item in items:
-            # print(fn_name, category, item.__name__)
-            # print(item.__name__ == fn_name)
-            if item.__name__ == fn_name:
-                args, _, __, defaults, ___, ____, _____ = inspect.getfullargspec(item)
-                found = True
-                break
-    return (list(zip(args, defaults)), item)
+            index.setdefault(item.__name__, item)
+    return index
+
+
+@lru_cache(maxsize=512)
+def _get_arguments_cached(plugin, fn_name):
+    """Look up fn_name in plugin's command index and introspect its
+    signature. The result is cached for the life of the process."""
+    item = _get_command_index(plugin)[fn_name]
+    args, _, __, defaults, ___, ____, _____ = inspect.getfullargspec(item)
+    return (tuple(zip(args, defaults)), item)
+
+
+@lru_cache(maxsize=4096)
+def _label(key):
+    """Return the label displayed for argument or command name key."""
+    return key.replace('_', ' ')
+
+
+@lru_cache(maxsize=1024)
+def _render_doc(fn):
+    """Return fn's docstring rendered from markdown to html. Docstrings
+    don't change for the life of the process, so this is cached."""
+    return Markup(markdown.markdown(dedent(str(fn.__doc__))))
 
 
 def render_textbox(key, value):
     """Render a textbox for a dynamic form."""
     name = key
-    label = key.replace('_', ' ')
+    label = _label(key)
     return flask.render_template(
         "textbox.html", name=name,
         label=label, value=value)
@@ -752,7 +790,7 @@ def render_textbox(key, value):
 def render_password_box(key, value):
     """Render a textbox for a dynamic form."""
     name = key
-    label = key.replace('_', ' ')
+    label = _label(key)
     return flask.render_template(
         "passwordbox.html", name=name,
         label=label, value=value)
@@ -761,7 +799,7 @@ def render_password_box(key, value):
 def render_checkbox(key, checked=False):
     """Render a checkbox for a dynamic form."""
     name = key
-    label = key.replace('_', ' ')
+    label = _label(key)
     checked = "checked=checked" if checked else ""
     return flask.render_template(
         "checkbox.html", name=name,
@@ -771,14 +809,14 @@ def render_checkbox(key, checked=False):
 def render_multitext(key):
     """Render a multi-value textbox for a dynamic form."""
     _id = key
-    label = key.replace('_', ' ')
+    label = _label(key)
     return flask.render_template("multitext.html", id=_id, label=label)
 
 
 def render_file_upload(plugin, key):
     """Render our custom file upload form control for a dynamic form."""
     name = key
-    label = key.replace('_', ' ')
+    label = _label(key)
     return flask.render_template(
         "fileupload.html", name=name,
         label=label, plugin=plugin)
@@ -822,93 +860,249 @@ def render_select_object_class(key):
         name=key, disclaimer=False)
 
 
+def _field(template, key, **context):
+    """Describe a form control for get_form to render. template is one of
+    the control templates used by the render_* functions above, and
+    context holds the variables it expects."""
+    context.setdefault("label", _label(key))
+    return dict(context, template=template, name=key, key=key, id=key)
+
+
+def _dispatch(handlers, value):
+    """Return the handler registered in handlers for the type of value.
+    The type's MRO is walked so subclasses are handled like their bases
+    (bool is checked before int, as isinstance did)."""
+    for _type in type(value).__mro__:
+        handler = handlers.get(_type)
+        if handler is not None:
+            return handler
+    return None
+
+
+def _form_bool(plugin, key, value, common):
+    checked = "checked=checked" if value else ""
+    return "checkboxes", _field("checkbox.html", key, checked=checked)
+
+
+def _form_list(plugin, key, value, common):
+    if key in _OBJECT_STATUS_SET:
+        return "selects", _field(
+            "multiselect.html", key,
+            options=common[key], disclaimer=True)
+    elif key == "StatusProvider":
+        return "selects", _field(
+            "multiselect.html", key,
+            options=STATUS_PROVIDERS, disclaimer=False)
+    elif key == "ObjectClass":
+        return "selects", _field(
+            "multiselect.html", key,
+            options=OBJECT_STATUS_ARGS, disclaimer=False)
+    return "textboxes", _field("multitext.html", key)
+
+
+def _form_str(plugin, key, value, common):
+    if key in _OBJECT_STATUS_SET:
+        return "selects", _field(
+            "dynselect.html", key,
+            options=common[key], disclaimer=True)
+    elif key == "StatusProvider":
+        return "selects", _field(
+            "dynselect.html", key,
+            options=STATUS_PROVIDERS, disclaimer=False)
+    elif key == "ObjectClass":
+        return "selects", _field(
+            "dynselect.html", key,
+            options=OBJECT_STATUS_ARGS, disclaimer=False)
+    elif "password" in key:
+        return "textboxes", _field("passwordbox.html", key, value=value)
+    return "textboxes", _field("textbox.html", key, value=value)
+
+
+def _form_int(plugin, key, value, common):
+    return "textboxes", _field("textbox.html", key, value=value)
+
+
+def _form_none(plugin, key, value, common):
+    if key == 'file_in':
+        return "file_uploads", _field("fileupload.html", key)
+    return "textboxes", _field("textbox.html", key, value='')
+
+
+# Arguments which are filled in by the web GUI itself and so never shown
+# on the form
+_HIDDEN_ARGS = frozenset((
+    "web",
+    "appliances",
+    "credentials",
+    "out_dir",
+    "out_file",
+))
+
+# Form controls for an argument, keyed by the type of its default value.
+# Each returns the group the control belongs in and its description, or
+# None if the argument isn't shown on the form
+_FORM_HANDLERS = {
+    bool: _form_bool,
+    list: _form_list,
+    str: _form_str,
+    int: _form_int,
+    type(None): _form_none,
+}
+
+
 def get_form(plugin, fn_name, appliances, credentials, no_check_hostname=True):
     """Return a form suitable for gathering arguments to function name"""
     check_hostname = not no_check_hostname
-    textboxes = []
-    checkboxes = []
-    file_uploads = []
-    selects = []
+    # Controls are rendered group by group, in this order
+    groups = {
+        "textboxes": [],
+        "selects": [],
+        "file_uploads": [],
+        "checkboxes": [],
+    }
 
-    env = Environment(appliances, credentials, check_hostname=check_hostname)
+    arguments, fn = _get_arguments(plugin, fn_name)
+    # The environment is only needed to list the objects common to the
+    # appliances, so don't build it for forms which don't show them.
+    # Otherwise look up every class the form needs in one pass.
+    common = {}
+    classes = {key for key, _ in arguments if key in _OBJECT_STATUS_SET}
+    if classes:
+        env = Environment(
+            appliances, credentials, check_hostname=check_hostname)
+        common = env.common_configs(classes, concurrent=True)
+    for key, value in arguments:
+        if key in _HIDDEN_ARGS:
+            continue
+        handler = _dispatch(_FORM_HANDLERS, value)
+        if handler is None:
+            continue
+        control = handler(plugin, key, value, common)
+        if control is not None:
+            group, field = control
+            groups[group].append(field)
 
-    forms = ['<div class="{0}Form"><div name="{1}">'.format(plugin, fn_name)]
+    # Render the whole form in one pass rather than calling render_template
+    # for every control
+    return flask.render_template(
+        "dynform.html",
+        plugin=plugin,
+        fn_name=fn_name,
+        label=_label(fn_name),
+        help=_render_doc(fn),
+        fields=chain.from_iterable(groups.values()))
 
-    label = fn_name.replace('_', ' ')
-    forms.append(flask.render_template('formlabel.html', label=label))
 
-    #md = markdown.Markdown(extensions=['markdown.extensions.extra'])
-    arguments, fn = _get_arguments(plugin, fn_name)
-    forms.append('<a href="#" class="help">help</a>')
-    forms.append('<div class="hidden help_content">{}</div>'.format(
-        Markup(markdown.markdown(dedent(str(fn.__doc__))))))
-    for arg in arguments:
-        key, value = arg
-        if isinstance(value, bool):
-            if key == "web":
-                continue
-            if value:
-                checkboxes.append(render_checkbox(key, checked=True))
-                continue
-            else:
-                checkboxes.append(render_checkbox(key))
-                continue
-        elif isinstance(value, list):
-            if key == 'appliances' or key == 'credentials':
-                continue
-            elif key in OBJECT_STATUS_ARGS:
-                selects.append(render_multiselect_object_status(key, env))
-                continue
-            elif key == "StatusProvider":
-                selects.append(render_multiselect_status_provider(key))
-                continue
-            elif key == "ObjectClass":
-                selects.append(render_multiselect_object_class(key))
-                continue
-            textboxes.append(render_multitext(key))
-        elif isinstance(value, str):
-            if key == 'out_dir':
-                continue
-            elif key == 'out_file':
-                continue
-            elif key in OBJECT_STATUS_ARGS:
-                selects.append(render_select_object_status(key, env))
-                continue
-            elif key == "StatusProvider":
-                selects.append(render_select_status_provider(key))
-                continue
-            elif key == "ObjectClass":
-                selects.append(render_select_object_class(key))
-                continue
-            elif "password" in key:
-                textboxes.append(render_password_box(key, value))
-                continue
-            textboxes.append(render_textbox(key, value))
-        elif isinstance(value, int):
-            textboxes.append(render_textbox(key, value))
-        elif value is None:
-            if key == 'out_file':
-                continue
-            elif key == 'file_in':
-                file_uploads.append(render_file_upload(plugin, key))
-                continue
-            textboxes.append(render_textbox(key, ''))
-
-    forms.extend(textboxes)
-    forms.extend(selects)
-    forms.extend(file_uploads)
-    forms.extend(checkboxes)
-    forms.append(flask.render_template('submitbutton.html', plugin=plugin))
-    forms.append('</div></div>')
-    return '<br />\n'.join(forms)
+def _get_form_cached(plugin, fn_name, appliances, credentials):
+    """Return get_form's form, reusing one rendered for the same
+    appliances and credentials within the last FORM_TTL seconds. The
+    objects listed on a form may lag the appliances by that much. In
+    debug mode the form is always rendered afresh."""
+    if flask.current_app.debug:
+        return get_form(plugin, fn_name, appliances, credentials)
+    key = (
+        plugin,
+        fn_name,
+        tuple(appliances),
+        hashlib.sha256(
+            b"\0".join(
+                c if isinstance(c, bytes) else c.encode()
+                for c in credentials)
+        ).digest(),
+    )
+    now = monotonic()
+    with _forms_lock:
+        for _key, (_, expires) in list(_forms.items()):
+            if expires < now:
+                del _forms[_key]
+        if key in _forms:
+            return _forms[key][0]
+    form = get_form(plugin, fn_name, appliances, credentials)
+    with _forms_lock:
+        _forms[key] = (form, now + FORM_TTL)
+    return form
+
+
+def _copyfile(src, dst):
+    """Copy src to dst. On Linux, dst is first made a reflink of src
+    where the filesystem supports it, otherwise the copy is made by the
+    kernel with copy_file_range, which also lets filesystems that support
+    it copy server-side. Otherwise, or if the filesystem refuses, fall
+    back to shutil.copyfile where it copies in the kernel too, or to
+    copying through a COPY_BUFSIZE buffer."""
+    if hasattr(os, "copy_file_range"):
+        src_fd = os.open(src, os.O_RDONLY | os.O_CLOEXEC)
+        try:
+            dst_fd = os.open(
+                dst, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_CLOEXEC,
+                0o666)
+            try:
+                if fcntl is not None:
+                    try:
+                        # Ask the filesystem to share src's extents (a
+                        # reflink), which copies nothing at all
+                        fcntl.ioctl(dst_fd, FICLONE, src_fd)
+                        return
+                    except OSError:
+                        # e.g. EXDEV, or EOPNOTSUPP on filesystems without
+                        # copy on write
+                        pass
+                try:
+                    remaining = os.fstat(src_fd).st_size
+                    while remaining > 0:
+                        copied = os.copy_file_range(
+                            src_fd, dst_fd, remaining)
+                        if copied == 0:
+                            break
+                        remaining -= copied
+                    return
+                except OSError:
+                    # e.g. ENOSYS, EXDEV or EOPNOTSUPP
+                    pass
+            finally:
+                os.close(dst_fd)
+        finally:
+            os.close(src_fd)
+    if hasattr(os, "sendfile") or sys.platform == "darwin":
+        # shutil.copyfile already copies in the kernel here
+        shutil.copyfile(src, dst)
+        return
+    with open(src, "rb", buffering=0) as fsrc, \
+            open(dst, "wb", buffering=0) as fdst:
+        with memoryview(bytearray(COPY_BUFSIZE)) as buf:
+            while True:
+                read = fsrc.readinto(buf)
+                if not read:
+                    break
+                fdst.write(buf[:read])
+
+
+def _publish(src, dst):
+    """Make the finished output file src available at dst. Where both are
+    on the same filesystem, dst is a hard link to src, so nothing is
+    copied; src must not be modified afterwards. Otherwise src is copied."""
+    try:
+        try:
+            os.link(src, dst)
+        except FileExistsError:
+            os.unlink(dst)
+            os.link(src, dst)
+    except OSError:
+        # e.g. EXDEV across filesystems, or no hard link support
+        _copyfile(src, dst)
+
+
+@lru_cache(maxsize=1)
+def _static_dir():
+    """Return the static directory configured in server.conf. This is
+    read once; call _static_dir.cache_clear() to pick up changes."""
+    return get_config("server.conf").get('dirs', 'static')
 
 
 def _call_method(func, kwargs):
     """Call func with kwargs if web is in kwargs, func should return a
     two-tupple containing (html, request_history). Here, we write the hsitory
     to a file and return the html for inclusion in the web GUI."""
-    import random
-    random.seed()
     if "appliances" not in kwargs:
         pass
     elif not kwargs["appliances"][0]:
@@ -927,7 +1121,6 @@ def _call_method(func, kwargs):
             # but if one makes it's way up here, we need to let the user know
             # part of that is suppressing the exception (because otherwise
             # we have no way of sending back the details)
-            import traceback
             msg = "Sorry, an unhandled exception occurred while "
             msg += "performing action:\n\n\t {}".format(str(e))
             out, hist = msg, traceback.format_exc()
@@ -935,18 +1128,105 @@ def _call_method(func, kwargs):
         t = Timestamp()
 
         # TODO: move this path to configuration
-        filename = os.path.join(
-            "var", "www", "static", "tmp", "request_history", t.timestamp)
-        if not os.path.exists(filename):
-            os.makedirs(filename)
+        filename = os.path.join(REQUEST_HISTORY_DIR, t.timestamp)
+        os.makedirs(filename, exist_ok=True)
         rand = random.randint(10000, 99999)
         _id = "{}-{}.log".format(str(t.timestamp), str(rand))
         filename = os.path.join(filename, _id)
-        with open(filename, 'wb') as fout:
-            fout.write(hist.encode())
+        # Encode the history a slice at a time, so a large history isn't
+        # copied into one big bytes object. newline="" keeps line endings
+        # as they are.
+        with open(filename, 'w', encoding='utf-8', newline='') as fout:
+            for i in range(0, len(hist), HISTORY_CHUNK_SIZE):
+                fout.write(hist[i:i + HISTORY_CHUNK_SIZE])
         return Markup(out), _id
 
 
+@lru_cache(maxsize=128)
+def _cookie_key(cookie):
+    """Return the key used to decode the credentials a client sends,
+    derived from its cookie. A client keeps the same cookie across
+    requests, so this is cached."""
+    return xorencode(cookie, key="_")
+
+
+def _decode_credentials(cookie, encoded, unquote=False):
+    """Decode the credentials in encoded, which the GUI sends XORed with a
+    key derived from the client's cookie. If unquote is True they are
+    percent-decoded first. The functions used in the loops are bound to
+    locals, since a request can carry credentials for many appliances."""
+    key = _cookie_key(cookie)
+    decode = xordecode
+    if unquote:
+        unquote_to_bytes = urllib.parse.unquote_to_bytes
+        return [decode(unquote_to_bytes(c), key=key) for c in encoded]
+    return [decode(c.encode(), key=key) for c in encoded]
+
+
+def _kwarg_bool(arg, default, form, name, t):
+    if arg == "web":
+        return True
+    return form.get(arg) == 'true'
+
+
+def _kwarg_list(arg, default, form, name, t):
+    # TODO: This needs to implement a selection feature
+    if arg == 'credentials':
+        return _decode_credentials(
+            flask.request.cookies["9x4h/mmek/j.ahba.ckhafn"],
+            form.getlist(arg + '[]'))
+    return form.getlist(arg + '[]')
+
+
+def _kwarg_str(arg, default, form, name, t):
+    if arg == 'out_dir':
+        return os.path.join('tmp', 'web', name, t.timestamp)
+    elif arg == 'out_file':
+        return os.path.join("tmp",
+                            "web",
+                            name,
+                            "{}-{}{}".format(t.timestamp,
+                                             name,
+                                             os.path.splitext(default)[1])
+        ).replace(os.path.sep, "/")
+    return form.get(arg) or default
+
+
+def _kwarg_int(arg, default, form, name, t):
+    value = form.get(arg)
+    return int(value) if value else default
+
+
+def _kwarg_none(arg, default, form, name, t):
+    return form.get(arg) or default
+
+
+# The value passed for an argument, keyed by the type of its default value
+_KWARG_HANDLERS = {
+    bool: _kwarg_bool,
+    list: _kwarg_list,
+    str: _kwarg_str,
+    int: _kwarg_int,
+    type(None): _kwarg_none,
+}
+
+
+@lru_cache(maxsize=None)
+def _get_template(name):
+    """Return the compiled template name from the app's jinja environment."""
+    return flask.current_app.jinja_env.get_template(name)
+
+
+def _render(name, **context):
+    """Render template name from a cached Template, skipping the loader
+    lookup flask.render_template does on every call. These templates only
+    use the variables they are passed. In debug mode this defers to
+    flask.render_template so template edits show up on reload."""
+    if flask.current_app.debug:
+        return flask.render_template(name, **context)
+    return _get_template(name).render(**context)
+
+
 def call_method(plugin, form):
     """Gather the arguments and function name from form then invoke
     _call_method. Wrap the results in html and return them."""
@@ -955,111 +1235,70 @@ def call_method(plugin, form):
     arguments, func = _get_arguments(plugin, name)
     kwargs = {}
     for arg, default in arguments:
-        if isinstance(default, bool):
-            if arg == "web":
-                kwargs[arg] = True
-                continue
-            value = form.get(arg)
-            if value == 'true':
-                kwargs[arg] = True
-            else:
-                kwargs[arg] = False
-        elif isinstance(default, list):
-            # TODO: This needs to implement a selection feature
-            if arg == 'appliances':
-                kwargs[arg] = form.getlist(arg + '[]')
-            elif arg == 'credentials':
-                kwargs[arg] = [
-                    xordecode(
-                        _.encode(), key=xorencode(
-                            flask.request.cookies["9x4h/mmek/j.ahba.ckhafn"], key="_"))
-                            for _ in form.getlist(arg + '[]')]
-            else:
-                kwargs[arg] = form.getlist(arg + '[]')
-        elif isinstance(default, str):
-            if arg == 'out_dir':
-                kwargs[arg] = os.path.join('tmp', 'web', name, t.timestamp)
-            elif arg == 'out_file' and default is not None:
-                kwargs[arg] = os.path.join("tmp",
-                                           "web",
-                                           name,
-                                           "{}-{}{}".format(t.timestamp,
-                                                            name,
-                                                            os.path.splitext(default)[1])
-                ).replace(os.path.sep, "/")
-            else:
-                kwargs[arg] = form.get(arg) or default
-        elif isinstance(default, int):
-            kwargs[arg] = int(form.get(arg)) or default
-        elif default is None:
-            kwargs[arg] = form.get(arg) or default
+        handler = _dispatch(_KWARG_HANDLERS, default)
+        if handler is not None:
+            kwargs[arg] = handler(arg, default, form, name, t)
     out, history_id = _call_method(func, kwargs)
-    link = ""
+    # The name of a file in the static tmp directory to link to, if any
+    filename = None
     if 'out_dir' in kwargs:
-        config = get_config("server.conf")
-        static_dir = config.get('dirs', 'static')
+        static_dir = _static_dir()
 
-        fname = ""
-        for appliance in kwargs['appliances']:
-            fname = "{}-{}".format(fname, appliance)
+        fname = "".join("-" + appliance for appliance in kwargs['appliances'])
         fname = "{}-{}{}.zip".format(t.timestamp, name, fname)
         zip_filename = os.path.join(
             static_dir,
             'tmp',
             fname)
-        zip_file = zipfile.ZipFile(zip_filename, 'w', zipfile.ZIP_DEFLATED)
-        _zipdir(kwargs['out_dir'], zip_file)
-        zip_file.close()
-        #filename = '%s-%s.zip' % (t.timestamp, name)
-        link = Markup(flask.render_template('link.html', filename=fname))
+        with zipfile.ZipFile(zip_filename, 'w', zipfile.ZIP_DEFLATED,
+                             compresslevel=1) as zip_file:
+            _zipdir(kwargs['out_dir'], zip_file)
+        filename = fname
     if 'out_file' in kwargs and kwargs["out_file"] is not None:
-        import shutil
-        config = get_config("server.conf")
-        static_dir = config.get('dirs', 'static')
+        static_dir = _static_dir()
         dst = os.path.join(static_dir,
                            "tmp",
                            os.path.basename(kwargs["out_file"]))
-        shutil.copyfile(kwargs["out_file"], dst)
-
-        link = Markup(flask.render_template('link.html',
-                                                  filename=os.path.basename(kwargs["out_file"])))
-    out = flask.render_template(
+        _publish(kwargs["out_file"], dst)
+        filename = os.path.basename(kwargs["out_file"])
+    out = _render(
         'output.html',
         output=out,
         callable=name,
         timestamp=str(t),
         history_id=history_id,
-        link=link)
-    if 'out_dir' in kwargs:
-        out = out
-    return out
+        filename=filename)
+    return Markup(out)
 
 
 def handle(plugin):
     """main funcion which will be routed to the plugin's endpoint"""
     logger = make_logger("mast.plugin_functions")
-    import urllib.request, urllib.parse, urllib.error
-    if flask.request.method == 'GET':
+    # Resolve the request proxy once rather than on every attribute access
+    request = flask.request._get_current_object()
+    if request.method == 'GET':
         logger.info("GET Request received")
-        name = flask.request.args.get('callable')
-        logger.debug("name: {}".format(name))
-        appliances = flask.request.args.getlist('appliances[]')
-        logger.debug("appliances: {}".format(str(appliances)))
-        credentials = [xordecode(urllib.parse.unquote(_).encode(), key=xorencode(
-                        flask.request.cookies["9x4h/mmek/j.ahba.ckhafn"], key="_"))
-                        for _ in flask.request.args.getlist('credentials[]')]
+        name = request.args.get('callable')
+        logger.debug("name: %s", name)
+        appliances = request.args.getlist('appliances[]')
+        logger.debug("appliances: %s", appliances)
+        credentials = _decode_credentials(
+            request.cookies["9x4h/mmek/j.ahba.ckhafn"],
+            request.args.getlist('credentials[]'),
+            unquote=True)
         logger.debug("getting form")
         try:
-            form = get_form(plugin.replace("mast.", ""), name, appliances, credentials)
+            form = _get_form_cached(
+                plugin.replace("mast.", ""), name, appliances, credentials)
         except:
             logger.exception("An unhandled exception occurred during execution.")
             raise
         logger.debug("Got form")
         return form
-    elif flask.request.method == 'POST':
-        logger.info("Received POST request for {}".format(plugin))
+    elif request.method == 'POST':
+        logger.info("Received POST request for %s", plugin)
         try:
-            return Markup(str(call_method(plugin, flask.request.form)))
+            return call_method(plugin, request.form)
         except:
             logger.exception("An unhandled exception occurred during processing of request.")
             raise
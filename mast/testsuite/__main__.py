@@ -72,11 +72,15 @@ def main(out_file="stdout",
         suites = [unittest_suite, integration_suite, regression_suite]
 
     suite = unittest.TestSuite(suites)
+    kwargs = {"verbosity": 0}
+    if sys.version_info >= (3, 12):
+        # Report how long each test took, slowest first
+        kwargs["durations"] = 0
     if out_file is "stdout":
-        unittest.TextTestRunner(stream=sys.stdout, verbosity=0).run(suite)
+        unittest.TextTestRunner(stream=sys.stdout, **kwargs).run(suite)
     else:
         with open(out_file, "w") as fp_out:
-            unittest.TextTestRunner(stream=fp_out, verbosity=0).run(suite)
+            unittest.TextTestRunner(stream=fp_out, **kwargs).run(suite)
 
 
 if __name__ == "__main__":
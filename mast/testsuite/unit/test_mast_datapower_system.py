@@ -17,7 +17,6 @@
 Unittests for mast.datapower.system
 """
 import mast.datapower.system
-from time import time
 import unittest
 import mock
 
@@ -25,48 +24,45 @@ test_zip = """UEsDBAoAAAAAAKt2m0jGNbk7BQAAAAUAAAAIABwAdGVzdC50eHRVVAkAA6EKIVehCi
 6AMAAAToAwAAdGVzdApQSwECHgMKAAAAAACrdptIxjW5OwUAAAAFAAAACAAYAAAAAAABAAAAtIEA
 AAAAdGVzdC50eHRVVAUAA6EKIVd1eAsAAQToAwAABOgDAABQSwUGAAAAAAEAAQBOAAAARwAAAAAA"""
 
-@mock.patch("mast.datapower.system.system.enable_domain")
-@mock.patch("mast.datapower.system.system.reboot_appliance")
-@mock.patch("mast.datapower.system.system.disable_domain")
-@mock.patch("mast.datapower.system.system.quiesce_appliance")
-@mock.patch("mast.datapower.system.system.save_config")
-@mock.patch("mast.datapower.system.system.clean_up")
-@mock.patch("mast.datapower.system.system.datapower.environment.DataPower.is_reachable", return_value=True)
-@mock.patch("mast.datapower.system.system.datapower.environment.DataPower.set_firmware")
-@mock.patch("mast.datapower.system.system.datapower.environment.DataPower.ssh_connect")
-@mock.patch("mast.datapower.system.system.datapower.environment.DataPower.ssh_issue_command")
-@mock.patch("mast.datapower.system.system.datapower.environment.DataPower.send_request")
-@mock.patch("mast.datapower.system.system.datapower.environment.DataPower.domains", new_callable=mock.PropertyMock, return_value=["test_domain"])
-@mock.patch("mast.datapower.system.system.datapower.environment.Environment.perform_action")
-@mock.patch("mast.datapower.system.system.get_normal_backup")
-@mock.patch("mast.datapower.system.system.make_logger")
-@mock.patch("mast.datapower.system.system.sleep")
 class TestFirmwareUpgrade(unittest.TestCase):
-    def setUp(self):
-        self.start_time = time()
+    @classmethod
+    def setUpClass(cls):
+        # Patch everything once for the class rather than once per test,
+        # grouping the targets which share a module or class
+        cls.mocks = {}
+        patchers = [
+            mock.patch.multiple(
+                "mast.datapower.system.system",
+                enable_domain=mock.DEFAULT,
+                reboot_appliance=mock.DEFAULT,
+                disable_domain=mock.DEFAULT,
+                quiesce_appliance=mock.DEFAULT,
+                save_config=mock.DEFAULT,
+                clean_up=mock.DEFAULT,
+                get_normal_backup=mock.DEFAULT,
+                make_logger=mock.DEFAULT,
+                sleep=mock.DEFAULT),
+            mock.patch.multiple(
+                "mast.datapower.system.system.datapower.environment.DataPower",
+                is_reachable=mock.MagicMock(return_value=True),
+                set_firmware=mock.DEFAULT,
+                ssh_connect=mock.DEFAULT,
+                ssh_issue_command=mock.DEFAULT,
+                send_request=mock.DEFAULT,
+                domains=mock.PropertyMock(return_value=["test_domain"])),
+            mock.patch.multiple(
+                "mast.datapower.system.system.datapower.environment.Environment",
+                perform_action=mock.DEFAULT),
+        ]
+        for patcher in patchers:
+            cls.mocks.update(patcher.start())
+            cls.addClassCleanup(patcher.stop)
 
-    def tearDown(self):
-        self.time_taken = time() - self.start_time
-        print("%.3f: %s" % (self.time_taken, self.id()))
+    def setUp(self):
+        for _mock in self.mocks.values():
+            _mock.reset_mock()
 
-    def test_firmware_upgrade_calls_functions_with_with_keyword_args(
-            self,
-            mock_sleep,
-            mock_make_logger,
-            mock_get_normal_backup,
-            mock_perform_action,
-            mock_domains,
-            mock_send_request,
-            mock_ssh_issue_command,
-            mock_ssh_connect,
-            mock_set_firmware,
-            mock_is_reachable,
-            mock_clean_up,
-            mock_save_config,
-            mock_quiesce_appliance,
-            mock_disable_domain,
-            mock_reboot_appliance,
-            mock_enable_domain):
+    def test_firmware_upgrade_calls_functions_with_with_keyword_args(self):
         """We had problems when changing the order of the arguments
         of a function when another function uses it. To overcome this, it is
         now a requirement that all function calls use keyword arguments.
@@ -75,12 +71,10 @@ class TestFirmwareUpgrade(unittest.TestCase):
         mast.datapower.system.firmware_upgrade(
             appliances=["test_1", "test_2"],
             credentials=["user:pass"])
-        self.assertEqual(mock_clean_up.call_args[0], ())
-        self.assertEqual(mock_get_normal_backup.call_args[0], ())
-        self.assertEqual(mock_save_config.call_args[0], ())
-        self.assertEqual(mock_quiesce_appliance.call_args[0], ())
-        self.assertEqual(mock_disable_domain.call_args[0], ())
-        self.assertEqual(mock_reboot_appliance.call_args[0], ())
-        self.assertEqual(mock_enable_domain.call_args[0], ())
-
-
+        self.assertEqual(self.mocks["clean_up"].call_args[0], ())
+        self.assertEqual(self.mocks["get_normal_backup"].call_args[0], ())
+        self.assertEqual(self.mocks["save_config"].call_args[0], ())
+        self.assertEqual(self.mocks["quiesce_appliance"].call_args[0], ())
+        self.assertEqual(self.mocks["disable_domain"].call_args[0], ())
+        self.assertEqual(self.mocks["reboot_appliance"].call_args[0], ())
+        self.assertEqual(self.mocks["enable_domain"].call_args[0], ())
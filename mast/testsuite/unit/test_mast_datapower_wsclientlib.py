@@ -0,0 +1,139 @@
+# This file is part of McIndi's Automated Solutions Tool (MAST).
+#
+# MAST is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3
+# as published by the Free Software Foundation.
+#
+# MAST is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with MAST.  If not, see <https://www.gnu.org/licenses/>.
+#
+# Copyright 2015-2024, McIndi Solutions, All rights reserved.
+"""
+Unittests for mast.datapower.datapower.WSClientLib
+"""
+import os
+import threading
+import unittest
+import urllib.error
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import mock
+from mast.config import MAST_HOME
+from mast.datapower.datapower.WSClientLib import Request
+
+TEST_CASE = os.path.join(MAST_HOME, "etc", "v7000-xi52.xml")
+URI = "/service/mgmt/current"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """Answers every POST with server.status and server.body and records
+    (client port, path, Authorization) in server.requests"""
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        self.server.requests.append(
+            (self.client_address[1], self.path, self.headers["Authorization"]))
+        if self.server.drop_before_response:
+            self.close_connection = True
+            return
+        self.send_response(self.server.status)
+        self.send_header("Content-Type", "text/xml")
+        self.send_header("Content-Length", str(len(self.server.body)))
+        self.end_headers()
+        self.wfile.write(self.server.body)
+        # Close the connection without announcing it, the way an
+        # appliance drops an idle keep-alive connection
+        self.close_connection = self.server.drop_after_response
+
+    def log_message(self, *args):
+        pass
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), _Handler)
+        self.requests = []
+        self.status = 200
+        self.body = b"<ok/>"
+        self.drop_after_response = False
+        self.drop_before_response = False
+        self.closed = threading.Event()
+
+    def shutdown_request(self, request):
+        super().shutdown_request(request)
+        self.closed.set()
+
+
+class TestRequestSend(unittest.TestCase):
+    def setUp(self):
+        self.server = _Server()
+        self.port = self.server.server_address[1]
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def request(self, host="127.0.0.1", port=None, uri=URI):
+        return Request("http", host, port or self.port, uri, "user:pass", TEST_CASE)
+
+    def test_send_reuses_the_connection(self):
+        """Consecutive requests to an appliance share one connection"""
+        self.assertEqual(self.request().send(secure=False), b"<ok/>")
+        self.assertEqual(self.request().send(secure=False), b"<ok/>")
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertEqual(len({port for port, _, _ in self.server.requests}), 1)
+        self.assertEqual(self.server.requests[0][2], "Basic dXNlcjpwYXNz")
+
+    def test_send_keeps_the_query_string(self):
+        self.request(uri=URI + "?a=1").send(secure=False)
+        self.assertEqual(self.server.requests[0][1], URI + "?a=1")
+
+    def test_send_reconnects_after_the_appliance_drops_the_connection(self):
+        self.server.drop_after_response = True
+        self.assertEqual(self.request().send(secure=False), b"<ok/>")
+        self.assertTrue(self.server.closed.wait(5))
+        self.assertEqual(self.request().send(secure=False), b"<ok/>")
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertEqual(len({port for port, _, _ in self.server.requests}), 2)
+
+    def test_send_does_not_resend_a_request_which_got_no_response(self):
+        """The appliance may have acted on the request, so it is not
+        sent again"""
+        self.server.drop_before_response = True
+        with self.assertRaises(urllib.error.URLError):
+            self.request().send(secure=False)
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_send_raises_http_error_for_non_2xx_responses(self):
+        self.server.status = 500
+        self.server.body = b"<error/>"
+        with self.assertRaises(urllib.error.HTTPError) as context:
+            self.request().send(secure=False)
+        self.assertEqual(context.exception.code, 500)
+        self.assertEqual(context.exception.read(), b"<error/>")
+
+    def test_send_goes_through_the_configured_proxy(self):
+        """The server here acts as the proxy, the appliance is not
+        resolvable so the request can only succeed through it"""
+        proxy = "http://127.0.0.1:{}".format(self.port)
+        environ = {"http_proxy": proxy, "HTTP_PROXY": proxy, "no_proxy": "", "NO_PROXY": ""}
+        with mock.patch.dict(os.environ, environ):
+            response = self.request(host="appliance.invalid", port=5550).send(secure=False)
+        self.assertEqual(response, b"<ok/>")
+        self.assertEqual(
+            self.server.requests[0][1],
+            "http://appliance.invalid:5550" + URI)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -13,7 +13,6 @@
 # along with MAST.  If not, see <https://www.gnu.org/licenses/>.
 #
 # Copyright 2015-2024, McIndi Solutions, All rights reserved.
-from time import time
 import unittest
 
 
@@ -23,13 +22,6 @@ class TestMASTImports(unittest.TestCase):
     by ensuring that each module can be imported. Also checks that each
     version has knowlege of its `__version__` which is a recent requirement.
     """
-    def setUp(self):
-        self.start_time = time()
-
-    def tearDown(self):
-        self.time_taken = time() - self.start_time
-        print("%.3f: %s" % (self.time_taken, self.id()))
-
     def test_import_mast_cli(self):
         import mast.cli as cli
         self.assertTrue(hasattr(cli, "__version__"))
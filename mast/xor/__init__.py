@@ -36,10 +36,17 @@ security.
 import os
 import base64
 from itertools import cycle
+from functools import lru_cache
 from mast import __version__
 from mast.config import get_config_dict
 from mast.util import _s
 
+@lru_cache(maxsize=256)
+def _xor_table(byte):
+    """Return a bytes.translate table which XORs every byte with byte."""
+    return bytes(b ^ byte for b in range(256))
+
+
 def xorencode(string, key=None):
     """
     _function_: `mast.xor.xorencode(string, key="_")`
@@ -88,4 +95,15 @@ def xordecode(string, key=None):
         config = get_config_dict("xor.conf")
         key = config["global"].get("key")
     string = base64.decodebytes(_s(string).encode())
-    return bytes(x ^ y for x, y in zip(string, cycle(key.encode()))).strip()
+    key = key.encode()
+    if not key:
+        return b""
+    if len(key) == 1:
+        # A single byte key (like the default) is a plain table lookup
+        return string.translate(_xor_table(key[0])).strip()
+    # XOR every byte at once by treating string and the repeated key
+    # as (arbitrarily large) integers
+    key = (key * (len(string) // len(key) + 1))[:len(string)]
+    return (
+        int.from_bytes(string, "big") ^ int.from_bytes(key, "big")
+    ).to_bytes(len(string), "big").strip()